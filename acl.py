@@ -0,0 +1,180 @@
+import hashlib
+import mmap
+import os
+import struct
+
+from typing import Iterable, Union
+
+EMPTY = frozenset()
+
+
+class AccessIndex:
+
+    """ ACL compiled to alert level -> frozenset of codes
+
+        acl: {code: [alert levels access is granted on]} as received from server
+    """
+
+    __slots__ = ('levels', 'size')
+
+    def __init__(self, acl: dict):
+        levels = {}
+        for code, state_list in acl.items():
+            code = str(code)
+            for state in state_list:
+                levels.setdefault(int(state), set()).add(code)
+        self.levels = {level: frozenset(codes) for level, codes in levels.items()}
+        self.size = self._count()
+
+    def codes(self, alert: Union[int, str]) -> frozenset:
+        """ Codes granted access on alert level """
+        return self.levels.get(int(alert), EMPTY)
+
+    def apply(self, add: dict, remove: Iterable[str] = ()) -> 'AccessIndex':
+        """ New index with entries added, modified or removed, only affected alert levels are copied """
+        add = {str(code): state_list for code, state_list in add.items()}
+        plus, minus = {}, {}
+        touched = {str(code) for code in remove} | set(add)
+        for level, codes in self.levels.items():
+            dropped = touched & codes
+            if dropped:
+                minus[level] = dropped
+        for code, state_list in add.items():
+            for state in state_list:
+                plus.setdefault(int(state), set()).add(code)
+        index = AccessIndex({})
+        index.levels = dict(self.levels)
+        for level in set(plus) | set(minus):
+            index.levels[level] = (self.levels.get(level, EMPTY) - minus.get(level, EMPTY)) | plus.get(level, EMPTY)
+        # size is counted from touched codes only, they were dropped from all levels and set again from add
+        dropped = set().union(*minus.values())
+        index.size = self.size - len(dropped) + len(set().union(*plus.values()))
+        return index
+
+    def _count(self) -> int:
+        """ Codes granted access on any alert level """
+        return len(frozenset().union(*self.levels.values()))
+
+    def __len__(self):
+        return self.size
+
+
+# compiled ACL file: header, then records sorted by code hash
+ACL_MAGIC = b'SKABACL1'
+ACL_HEADER = struct.Struct('>8sIQ16s')  # magic, records count, alert levels bitmask, records digest
+ACL_RECORD = struct.Struct('>8sQ')  # code hash, alert levels bitmask
+
+
+def code_hash(code: Union[int, str]) -> bytes:
+    """ 64-bit code hash, collisions are negligible for card lists of any realistic size """
+    return hashlib.blake2b(str(code).encode(), digest_size=8).digest()
+
+
+def acl_masks(acl: dict) -> dict:
+    """ ACL as {code hash: alert levels bitmask} """
+    masks = {}
+    for code, state_list in acl.items():
+        mask = 0
+        for state in state_list:
+            mask |= 1 << int(state)
+        key = code_hash(code)
+        masks[key] = masks.get(key, 0) | mask
+    return masks
+
+
+def read_acl_masks(path: str) -> dict:
+    """ Records of compiled ACL file as {code hash: alert levels bitmask} """
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    count = ACL_HEADER.unpack_from(data)[1]
+    return dict(ACL_RECORD.unpack_from(data, ACL_HEADER.size + idx * ACL_RECORD.size) for idx in range(count))
+
+
+def compile_acl(acl: dict, path: str) -> bool:
+    """ Write ACL to compiled file, returns False if file already has the same records """
+    return write_acl(acl_masks(acl), path)
+
+
+def patch_acl(path: str, add: dict, remove: Iterable[str] = ()) -> bool:
+    """ Add, modify or remove compiled ACL file entries without the rest of ACL mapping """
+    masks = read_acl_masks(path)
+    for code in remove:
+        masks.pop(code_hash(code), None)
+    masks.update(acl_masks(add))
+    return write_acl(masks, path)
+
+
+def write_acl(masks: dict, path: str) -> bool:
+    """ Write records to compiled ACL file, returns False if file already has the same records """
+    body = b''.join(ACL_RECORD.pack(key, masks[key]) for key in sorted(masks))
+    digest = hashlib.blake2b(body, digest_size=16).digest()
+    try:
+        with open(path, 'rb') as fh:
+            header = fh.read(ACL_HEADER.size)
+        if len(header) == ACL_HEADER.size and ACL_HEADER.unpack(header)[3] == digest:
+            return False
+    except FileNotFoundError:
+        pass
+
+    levels = 0
+    for mask in masks.values():
+        levels |= mask
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(ACL_HEADER.pack(ACL_MAGIC, len(masks), levels, digest))
+        fh.write(body)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+    return True
+
+
+class CompiledAccessIndex:
+
+    """ Memory-mapped compiled ACL file, codes are looked up with binary search by hash """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, levels, self.digest = ACL_HEADER.unpack_from(self.mm)
+        if magic != ACL_MAGIC or len(self.mm) != ACL_HEADER.size + self.size * ACL_RECORD.size:
+            raise ValueError(f'{path} is not a compiled ACL file')
+        self.levels = [level for level in range(levels.bit_length()) if levels & (1 << level)]
+
+    def mask(self, code: Union[int, str]) -> int:
+        """ Alert levels bitmask for code, 0 if code is unknown """
+        key = code_hash(code)
+        mm = self.mm
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = ACL_HEADER.size + mid * ACL_RECORD.size
+            probe = mm[offset:offset + 8]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return ACL_RECORD.unpack_from(mm, offset)[1]
+        return 0
+
+    def codes(self, alert: Union[int, str]) -> 'AlertView':
+        """ Codes granted access on alert level """
+        return AlertView(self, int(alert))
+
+    def __len__(self):
+        return self.size
+
+
+class AlertView:
+
+    """ Container of codes granted access on alert level in compiled ACL """
+
+    __slots__ = ('index', 'bit')
+
+    def __init__(self, index: CompiledAccessIndex, alert: int):
+        self.index = index
+        self.bit = 1 << alert
+
+    def __contains__(self, code: Union[int, str]) -> bool:
+        return bool(self.index.mask(code) & self.bit)
@@ -3,19 +3,36 @@ import os
 from skabenclient.config import SystemConfig
 from skabenclient.main import start_app
 
+from async_device import AsyncLockDevice
 from device import LockDevice
 from config import LockConfig
+from doors import setup_doors
+from logs import LOG_BURST, LOG_RATE, setup_async_logging
 
 root = os.path.abspath(os.path.dirname(__file__))
 
 sys_config_path = os.path.join(root, 'conf', 'system.yml')
 dev_config_path = os.path.join(root, 'conf', 'device.yml')
+acl_path = os.path.join(root, 'conf', 'acl.bin')
 
 if __name__ == "__main__":
     # setting up system configuration and logger
     app_config = SystemConfig(sys_config_path)
-    dev_config = LockConfig(dev_config_path)
-    device = LockDevice(app_config, dev_config)
+    # large card lists are kept in compiled memory-mapped file instead of device.yml
+    # config_flush_delay: state changes are written to device.yml in batches instead of on every door cycle
+    dev_config = LockConfig(dev_config_path,
+                            acl_path=acl_path if app_config.get('compiled_acl') else None,
+                            flush_delay=app_config.get('config_flush_delay'))
+    # runtime: 'thread' (main loop thread with serial reader thread) or 'asyncio' (single event loop thread)
+    lock_class = AsyncLockDevice if app_config.get('runtime') == 'asyncio' else LockDevice
+    device = lock_class(app_config, dev_config)
+    if app_config.get('async_logging', True):
+        # log records are formatted and written by listener thread, repeated messages are rate limited
+        setup_async_logging(device.logger,
+                            rate=app_config.get('log_rate', LOG_RATE),
+                            burst=app_config.get('log_burst', LOG_BURST))
+    # additional keypads and relays listed in `doors` are driven by the same process
+    setup_doors(app_config, device, os.path.join(root, 'conf'))
     device.gpio_setup()  # pins for laser control and serial interface for keypads
     start_app(app_config=app_config,
               device=device)
@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from typing import Optional
+
+from skabenclient.config import SystemConfig
+from skabenclient.helpers import make_event
+from heartbeat import sd_notify
+
+from comport import BACKOFF_MAX
+from config import LockConfig
+from device import LockDevice, SERIAL_EVENT
+from keypad import FrameReader
+from scheduler import LoopScheduler
+
+
+class AsyncLockDevice(LockDevice):
+
+    """ Smart Lock running in one asyncio event loop thread
+
+        Keypad port is read with loop.add_reader, feedback delays and timers are loop timers,
+        events from other threads (config changes, sound loader) are passed with call_soon_threadsafe.
+        Lock behaviour and config are the same as LockDevice ones.
+    """
+
+    def __init__(self,
+                 system_config: SystemConfig,
+                 device_config: LockConfig,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop or asyncio.new_event_loop()
+        super().__init__(system_config, device_config)
+        self.scheduler = LoopScheduler(self.loop, after=self.sync_state)
+        self.frames = None  # keypad FrameReader
+        self.serial_fd = None  # keypad port descriptor watched by loop
+        self.stopped = None  # future resolved when lock stops running
+
+    def run(self):
+        """ Running lock until self.running is reset
+
+            self.gpio_setup() must be performed before run
+        """
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.main())
+        return self.stop()
+
+    async def main(self):
+        """ Same startup as LockDevice.run, then events are processed by loop callbacks until stop """
+        self.stopped = self.loop.create_future()
+        self.on_start()
+        self.logger.info('running lock (asyncio)...')
+        self.q_int.put(make_event('device', 'reload'))
+        self.running = True
+        self.listen_keypad()
+        self.boot.mark('start')
+        self.logger.info(f'boot phases: {self.boot.report()}')
+        self.metrics.gauge('boot.running', self.boot.elapsed())
+        sd_notify('READY=1')
+        await self.stopped
+
+    def listen_keypad(self):
+        self.frames = FrameReader(self.port, self.metrics, self.capture)
+        self.serial_fd = self.port.fileno()
+        self.loop.add_reader(self.serial_fd, self._serial_ready)
+
+    def post(self, kind: str, payload=None, stamp: Optional[float] = None):
+        self.loop.call_soon_threadsafe(self.dispatch, (kind, payload, stamp or time.monotonic()))
+
+    def dispatch(self, event: tuple):
+        """ Process single event the same way LockDevice main loop does """
+        self.metrics.incr('loop.wakeups')
+        self._dump_metrics()
+        self.manage_sound()
+        self.handle_event(event)
+        self.sync_state()
+        kind, _, stamp = event
+        self.metrics.observe(f'event.{kind}', time.monotonic() - stamp)
+        if not self.running and self.stopped and not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def _serial_ready(self):
+        try:
+            chunk = self.port.read(self.port.in_waiting or 1)
+        except (OSError, ValueError, TypeError) as e:
+            # keypad port is reopened in executor thread, loop keeps running timers meanwhile
+            self.loop.remove_reader(self.serial_fd)
+            if self.link.closed:
+                return
+            self.link.lost(str(e) or type(e).__name__)
+            self._serial_reconnect()
+            return
+        for frame in self.frames.feed(chunk):
+            self.logger.debug('new data from serial: %r', frame.raw)
+            self.dispatch((SERIAL_EVENT, frame, frame.stamp))
+
+    def _serial_reconnect(self):
+        self.loop.run_in_executor(None, self.link.connect).add_done_callback(self._serial_reconnected)
+
+    def _serial_reconnected(self, future: asyncio.Future):
+        try:
+            port = future.result()
+        except Exception:
+            self.logger.exception('serial reconnect failed, retrying')
+            self.loop.call_later(BACKOFF_MAX, self._serial_reconnect)
+            return
+        if port:
+            self.port = port
+            self.listen_keypad()
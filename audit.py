@@ -0,0 +1,147 @@
+""" Access audit log: fixed-size memory-mapped ring of fixed-width records
+
+    python -m audit conf/audit.log [--since 1h] [--code CODE] [--format text|csv|json]
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import struct
+import sys
+import threading as th
+import time
+
+from typing import Iterator, NamedTuple, Optional
+
+from acl import code_hash
+
+AUDIT_MAGIC = b'SKABAUD1'
+AUDIT_HEADER = struct.Struct('>8sIIQ')  # magic, capacity, record size, records written since log creation
+AUDIT_RECORD = struct.Struct('>d8sBBHf')  # wall clock time, code hash, event, alert level, door, latency
+AUDIT_CAPACITY = 65536  # records, oldest are overwritten
+
+ACCESS_GRANTED = 1
+ACCESS_DENIED = 2
+EVENT_NAMES = {ACCESS_GRANTED: 'granted', ACCESS_DENIED: 'denied'}
+AUDIT_FIELDS = ('time', 'code', 'event', 'alert', 'door', 'latency_ms')  # exported record fields
+
+
+class AuditRecord(NamedTuple):
+    stamp: float  # unix time
+    code: bytes  # acl.code_hash of credential
+    event: int
+    alert: int
+    door: int  # 0 for main lock, door number otherwise
+    latency: float  # seconds from keypad input to decision
+
+    def as_dict(self) -> dict:
+        return {
+            'time': self.stamp,
+            'code': self.code.hex(),
+            'event': EVENT_NAMES.get(self.event, self.event),
+            'alert': self.alert,
+            'door': self.door,
+            'latency_ms': round(self.latency * 1000, 3),
+        }
+
+
+class AuditLog:
+
+    """ Access events ring log, survives restarts
+
+        Record is written before header counter, so record torn by crash is never read.
+        Existing log keeps capacity it was created with.
+        readonly: open existing log for queries only, it's never created or resized
+    """
+
+    def __init__(self, path: str, capacity: int = AUDIT_CAPACITY, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = th.Lock()
+        size = AUDIT_HEADER.size + capacity * AUDIT_RECORD.size
+        fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if readonly:
+                if os.fstat(fd).st_size < AUDIT_HEADER.size:
+                    raise ValueError(f'{path} is not an audit log')
+                self.mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            else:
+                if os.fstat(fd).st_size == 0:
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, AUDIT_HEADER.pack(AUDIT_MAGIC, capacity, AUDIT_RECORD.size, 0), 0)
+                self.mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, self.capacity, record_size, self.written = AUDIT_HEADER.unpack_from(self.mm)
+        expected = AUDIT_HEADER.size + self.capacity * AUDIT_RECORD.size
+        if magic != AUDIT_MAGIC or record_size != AUDIT_RECORD.size or len(self.mm) != expected:
+            self.mm.close()
+            raise ValueError(f'{path} is not an audit log')
+
+    def append(self, event: int, code: str, alert: int, latency: float = 0, door: int = 0):
+        with self._lock:
+            slot = self.written % self.capacity
+            AUDIT_RECORD.pack_into(self.mm, AUDIT_HEADER.size + slot * AUDIT_RECORD.size,
+                                   time.time(), code_hash(code), event, alert, door, latency)
+            self.written += 1
+            struct.pack_into('>Q', self.mm, AUDIT_HEADER.size - 8, self.written)
+
+    def records(self, since: Optional[float] = None, code: Optional[str] = None) -> Iterator[AuditRecord]:
+        """ Records oldest first, filtered by unix time and credential """
+        key = code_hash(code) if code is not None else None
+        written = self.written
+        first = max(0, written - self.capacity)
+        for seq in range(first, written):
+            offset = AUDIT_HEADER.size + (seq % self.capacity) * AUDIT_RECORD.size
+            record = AuditRecord(*AUDIT_RECORD.unpack_from(self.mm, offset))
+            if since is not None and record.stamp < since:
+                continue
+            if key is not None and record.code != key:
+                continue
+            yield record
+
+    def close(self):
+        if not self.readonly:
+            self.mm.flush()
+        self.mm.close()
+
+
+def _since(value: str) -> float:
+    """ 90, 90s, 15m, 1h, 2d ago as unix time """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value[-1] in units:
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    return time.time() - float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m audit', description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='audit log file')
+    parser.add_argument('--since', type=_since, help='only records newer than 90s, 15m, 1h, 2d')
+    parser.add_argument('--code', help='only records of this code or card')
+    parser.add_argument('--format', choices=('text', 'csv', 'json'), default='text')
+    args = parser.parse_args(argv)
+
+    try:
+        log = AuditLog(args.path, readonly=True)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    rows = [record.as_dict() for record in log.records(args.since, args.code)]
+    log.close()
+    if args.format == 'json':
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    elif args.format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=AUDIT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(row['time']))
+            print(f"{stamp} door {row['door']} {row['event']:<7} {row['code']} "
+                  f"alert {row['alert']} {row['latency_ms']}ms")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+""" Keypad serial traffic capture and replay
+
+    Capture file keeps raw serial chunks as they were read from port, including line noise,
+    partial frames and bursts: header, then (monotonic timestamp, chunk length, chunk bytes) records.
+"""
+import struct
+import threading as th
+import time
+
+from typing import Callable, Iterator, Optional, Tuple
+
+from keypad import FrameReader
+from metrics import Metrics
+
+CAPTURE_MAGIC = b'SKABCAP1'
+CAPTURE_HEADER = struct.Struct('>8sd')  # magic, wall clock time capture was started
+CAPTURE_RECORD = struct.Struct('>dI')  # monotonic timestamp, chunk length
+
+
+class CaptureWriter:
+
+    """ Appends serial chunks to capture file, every chunk is flushed so nothing is lost on crash """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fh = open(path, 'ab')
+        if not self.fh.tell():
+            self.fh.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.time()))
+        self._lock = th.Lock()  # doors share one capture
+
+    def write(self, chunk: bytes, stamp: Optional[float] = None):
+        with self._lock:
+            self.fh.write(CAPTURE_RECORD.pack(stamp or time.monotonic(), len(chunk)))
+            self.fh.write(chunk)
+            self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, bytes]]:
+    """ Iterate over capture records as (seconds since first chunk, chunk) """
+    with open(path, 'rb') as fh:
+        magic, _ = CAPTURE_HEADER.unpack(fh.read(CAPTURE_HEADER.size))
+        if magic != CAPTURE_MAGIC:
+            raise ValueError(f'{path} is not a serial capture file')
+        offset, previous = 0.0, None
+        while True:
+            header = fh.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                # capture could be cut by power loss
+                return
+            stamp, size = CAPTURE_RECORD.unpack(header)
+            chunk = fh.read(size)
+            if len(chunk) < size:
+                return
+            # capture appended after reboot starts from smaller monotonic time
+            if previous is not None and stamp >= previous:
+                offset += stamp - previous
+            previous = stamp
+            yield offset, chunk
+
+
+def replay(path: str, parse: Callable, realtime: bool = False, metrics: Optional[Metrics] = None) -> dict:
+    """ Push captured chunks through FrameReader to `parse` (usually LockDevice.parse_data)
+
+        realtime: keep original delays between chunks, otherwise replay as fast as possible
+    """
+    reader = FrameReader(metrics=metrics)
+    frames = chunks = 0
+    started = time.monotonic()
+    for offset, chunk in read_capture(path):
+        if realtime:
+            delay = started + offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        chunks += 1
+        for frame in reader.feed(chunk):
+            parse(frame.raw)
+            frames += 1
+    elapsed = time.monotonic() - started
+    return {
+        'chunks': chunks,
+        'frames': frames,
+        'seconds': elapsed,
+        'frames_per_sec': frames / elapsed if elapsed else 0,
+        'counters': reader.metrics.snapshot()['counters'],
+    }
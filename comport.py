@@ -0,0 +1,125 @@
+""" Keypad serial port connection: candidate ports probing, reconnection with exponential backoff """
+import logging
+import os
+import threading as th
+import time
+
+from typing import Callable, Iterable, Optional
+
+import serial
+
+from metrics import Metrics
+
+BAUDRATE = 9600
+SERIAL_TIMEOUT = 1
+FALLBACK_PORTS = ('/dev/ttyAMA1', '/dev/ttyUSB0', '/dev/ttyACM0')  # probed after configured comport
+BACKOFF_MIN = .1  # seconds between first probing rounds
+BACKOFF_MAX = 5  # keep below watchdog stall timeout, reader thread beats between rounds
+
+
+class SerialLink:
+
+    """ Keypad serial connection which survives USB-serial adapter resets
+
+        Candidate ports are probed in order, the first one which opens is used.
+        Port is lost on read error or when its device node vanishes or is replaced by a new one
+        (adapter re-enumerated). Candidates are probed again with exponential backoff until one opens.
+        Metrics: serial.recover histogram of seconds from loss to reconnect, serial.lost, serial.reconnects.
+    """
+
+    def __init__(self,
+                 candidates: Iterable[str],
+                 metrics: Optional[Metrics] = None,
+                 baudrate: int = BAUDRATE,
+                 timeout: float = SERIAL_TIMEOUT,
+                 opener: Callable = serial.Serial,
+                 clock: Callable = time.monotonic):
+        self.candidates = list(dict.fromkeys(path for path in candidates if path))
+        self.metrics = metrics or Metrics()
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.opener = opener
+        self.clock = clock
+        self.backoff_min = BACKOFF_MIN
+        self.backoff_max = BACKOFF_MAX
+        self.port = None
+        self.path = None
+        self.node = None  # identity of opened device node
+        self.lost_at = None
+        self._closed = th.Event()
+
+    def probe(self):
+        """ Try every present candidate once, returns opened port or None """
+        for path in self.candidates:
+            if not os.path.exists(path):
+                continue
+            try:
+                port = self.opener(path, baudrate=self.baudrate, timeout=self.timeout)
+            except (OSError, ValueError) as e:
+                logging.debug(f'serial {path} not available: {e}')
+                continue
+            self.port, self.path, self.node = port, path, self._node(path)
+            return port
+
+    def connect(self, idle: Optional[Callable] = None):
+        """ Probe candidates until one opens, returns port or None if link is closed
+
+            idle: called between probing rounds, e.g. to keep watchdog heartbeat
+        """
+        delay = self.backoff_min
+        while not self._closed.is_set():
+            port = self.probe()
+            if port:
+                if self.lost_at is not None:
+                    recover = self.clock() - self.lost_at
+                    self.lost_at = None
+                    self.metrics.observe('serial.recover', recover)
+                    self.metrics.incr('serial.reconnects')
+                    logging.info(f'serial reconnected to {self.path} in {recover:.1f}s')
+                else:
+                    logging.info(f'serial connected to {self.path}')
+                return port
+            if idle:
+                idle()
+            self._closed.wait(delay)
+            delay = min(delay * 2, self.backoff_max)
+
+    def stale(self) -> bool:
+        """ Device node of opened port vanished or was replaced """
+        return self.port is None or self._node(self.path) != self.node
+
+    def lost(self, reason: str = ''):
+        """ Drop broken port, recovery time is measured from the first loss """
+        if self.lost_at is None:
+            self.lost_at = self.clock()
+            self.metrics.incr('serial.lost')
+            logging.warning(f'serial {self.path} lost: {reason}')
+        self._close_port()
+
+    def reconnect(self, reason: str = '', idle: Optional[Callable] = None):
+        self.lost(reason)
+        return self.connect(idle)
+
+    def close(self):
+        self._closed.set()
+        self._close_port()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def _close_port(self):
+        port, self.port = self.port, None
+        if port:
+            try:
+                port.close()
+            except Exception:
+                logging.debug(f'failed to close {self.path}', exc_info=True)
+
+    @staticmethod
+    def _node(path: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_rdev
@@ -1,49 +1,330 @@
+import os
+import atexit
 import logging
+import threading as th
+from typing import Callable, Optional
+
 from skabenclient.config import DeviceConfig
 
+from acl import AccessIndex, CompiledAccessIndex, EMPTY, compile_acl, patch_acl
+
 ESSENTIAL = {
     'closed': True,
     'sound': True,
     'blocked': False,
     'acl': {},
 }
+DOOR_SHARED = ('blocked', 'alert', 'sound')  # door settings which follow main lock config
+
+
+class ConfigSnapshot:
+
+    """ Read-only consistent view of config values used by lock on every input """
+
+    __slots__ = ('version', 'closed', 'blocked', 'sound', 'alert', 'access_list')
+
+    def __init__(self, version: int, data: dict, access_list: frozenset):
+        setter = super().__setattr__
+        setter('version', version)
+        setter('closed', data.get('closed'))
+        setter('blocked', data.get('blocked'))
+        setter('sound', data.get('sound'))
+        setter('alert', data.get('alert', '0'))
+        setter('access_list', access_list)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('config snapshot is read-only')
+
+    def __repr__(self):
+        return f'<ConfigSnapshot v{self.version} closed={self.closed} blocked={self.blocked} sound={self.sound}>'
 
 
 class LockConfig(DeviceConfig):
 
-    def __init__(self, config_path: str):
-        self.parsed_acl = []
+    """ Lock config with ACL index and snapshots
+
+        flush_delay: write-behind mode, saved changes are applied in memory at once
+                     and written to disk in batches at most `flush_delay` seconds later
+
+        Besides full `acl` mapping config data could carry ACL delta, applied on top of `acl_version`:
+
+            acl_delta:
+              version: 43            # ACL version after delta
+              add: {CODE: [1, 2]}    # new or modified entries
+              remove: [CODE]
+
+        ACL received without `acl_version` takes version of the first delta applied to it.
+    """
+
+    def __init__(self, config_path: str, acl_path: Optional[str] = None, flush_delay: Optional[float] = None):
+        self.parsed_acl = EMPTY  # codes granted access on current alert level
+        self.acl_index = None
+        self.acl_source = None  # acl mapping acl_index was compiled from
+        self._acl_owned = None  # acl mapping copied by config, changed in place by ACL deltas until written
+        self.acl_path = acl_path  # compiled ACL file, acl mapping is not kept in config file when set
+        self.resync_needed = False  # ACL delta version gap, full config should be requested from server
+        self.snapshot = None  # replaced as a whole on every config change
+        self.version = 0
+        self._publish_lock = th.Lock()
+        self.listeners = []
+        self.flush_delay = flush_delay
+        self.dirty = False  # changes not written to disk yet
+        self._flush_timer = None
+        self._data_lock = th.Lock()
+        self._write_lock = th.Lock()
         self.minimal_essential_conf = ESSENTIAL
         super().__init__(config_path)
+        if flush_delay is not None:
+            atexit.register(self.flush, True)
 
     @property
-    def access_list(self) -> list:
-        if not self.parsed_acl:
-            self.parsed_acl = self.gen_access_list()
+    def access_list(self) -> frozenset:
+        if self.acl_index is None:
+            self.gen_access_list()
+        return self.parsed_acl
+
+    def gen_access_list(self) -> frozenset:
+        """ Compile ACL index from scratch and select codes for current alert level """
+        if self.acl_path:
+            if not os.path.exists(self.acl_path):
+                compile_acl(self.get('acl', {}), self.acl_path)
+            self.acl_index = CompiledAccessIndex(self.acl_path)
+            logging.debug(f'ACL mapped, {len(self.acl_index)} codes on alert levels {self.acl_index.levels}')
+            return self.select_access_list()
+        self.acl_source = self.get('acl', {})
+        self.acl_index = AccessIndex(self.acl_source)
+        logging.debug(f'ACL regen, {len(self.acl_index)} codes on alert levels {sorted(self.acl_index.levels)}')
+        return self.select_access_list()
+
+    def select_access_list(self) -> frozenset:
+        """ Switch current ACL to alert level from config """
+        self.parsed_acl = self.acl_index.codes(self.get('alert', '0'))
         return self.parsed_acl
 
-    def gen_access_list(self) -> list:
-        result = []
-        not_parsed = self.get('acl', {})
-        current_alert = int(self.get('alert', '0'))
-        # get unique state ids list like [1, 2, ..., 5]
-        unique_states = list(set(sum(list(not_parsed.values()), [])))
-        if current_alert not in unique_states:
-            # no access codes configured for current alert level
-            return result
-
-        for code, state_list in not_parsed.items():
-            state_list = [int(state) for state in state_list]
-            if current_alert in state_list:
-                result.append(code)
-
-        logging.debug(f'ACL regen, current ACL is: {result}')
+    def refresh_access_list(self) -> frozenset:
+        """ Recompile ACL index only if acl mapping has changed """
+        if self.acl_index is None:
+            return self.gen_access_list()
+        if not self.acl_path and self.get('acl', {}) != self.acl_source:
+            return self.gen_access_list()
+        return self.select_access_list()
+
+    def compile_access_list(self, acl: dict) -> frozenset:
+        """ Write acl mapping to compiled ACL file and switch to it """
+        if compile_acl(acl, self.acl_path) or self.acl_index is None:
+            self.acl_index = CompiledAccessIndex(self.acl_path)
+            logging.debug(f'ACL compiled, {len(self.acl_index)} codes on alert levels {self.acl_index.levels}')
+        return self.select_access_list()
+
+    def apply_acl_delta(self, delta: dict) -> bool:
+        """ Apply ACL delta to index and ACL storage, returns False if full resync is needed """
+        version = delta.get('version')
+        current = self.get('acl_version')
+        if version is not None and current is None:
+            # ACL was received without version, delta becomes the baseline
+            logging.info(f'ACL delta v{version} applied to unversioned ACL')
+        elif version is not None and int(version) <= int(current):
+            logging.debug(f'ACL delta v{version} skipped, already at v{current}')
+            return True
+        elif version is None or int(version) != int(current) + 1:
+            logging.warning(f'ACL delta v{version} does not follow v{current}, full resync needed')
+            self.resync_needed = True
+            return False
+
+        add = {str(code): state_list for code, state_list in (delta.get('add') or {}).items()}
+        remove = [str(code) for code in delta.get('remove') or ()]
+        if self.acl_path:
+            if patch_acl(self.acl_path, add, remove) or self.acl_index is None:
+                self.acl_index = CompiledAccessIndex(self.acl_path)
+        else:
+            if self.acl_index is None:
+                self.gen_access_list()
+            with self._data_lock:
+                acl = self.data.get('acl')
+                if acl is None or acl is not self._acl_owned:
+                    # mapping received from server or handed to config writer is copied once, not on every delta
+                    acl = dict(acl or {})
+                    self.data['acl'] = self._acl_owned = acl
+                for code in remove:
+                    acl.pop(code, None)
+                    if code.isdigit():
+                        acl.pop(int(code), None)
+                acl.update(add)
+            self.acl_source = acl
+            self.acl_index = self.acl_index.apply(add, remove)
+        logging.debug(f'ACL delta v{version}: {len(add)} set, {len(remove)} removed, {len(self.acl_index)} codes')
+        self.select_access_list()
+        return True
+
+    def _take_acl_delta(self, args: tuple, kwargs: dict):
+        """ Apply ACL delta from new config data, only new ACL version goes to config """
+        data = args[0] if args else kwargs.get('data')
+        if not isinstance(data, dict) or data is self.data:
+            return args, kwargs
+        unversioned = 'acl' in data and 'acl_version' not in data and self.get('acl_version') is not None
+        if not unversioned and 'acl_delta' not in data:
+            return args, kwargs
+        data = dict(data)
+        if unversioned:
+            # full ACL without version replaces versioned one, next delta sets new baseline
+            data['acl_version'] = None
+        if 'acl_delta' in data:
+            delta = data.pop('acl_delta') or {}
+            if self.apply_acl_delta(delta):
+                current = self.get('acl_version')
+                data['acl_version'] = max(int(delta['version']), int(current if current is not None else 0))
+        return self._with_data(args, kwargs, data)
+
+    @staticmethod
+    def _with_data(args: tuple, kwargs: dict, data: dict):
+        if args:
+            return (data,) + args[1:], kwargs
+        return args, dict(kwargs, data=data)
+
+    def _take_acl(self, args: tuple, kwargs: dict):
+        """ In compiled ACL mode acl mapping from new config data goes to ACL file instead of config """
+        data = args[0] if args else kwargs.get('data')
+        if not self.acl_path or not isinstance(data, dict) or 'acl' not in data:
+            return args, kwargs
+        if data is self.data or data is self.minimal_essential_conf:
+            return args, kwargs
+        data = dict(data)
+        acl = data.pop('acl')
+        # empty acl before config is loaded is just a default, not a revocation
+        if acl or self.snapshot:
+            self.compile_access_list(acl or {})
+        return self._with_data(args, kwargs, data)
+
+    def _refresh(self, args: tuple, kwargs: dict):
+        """ Rebuild ACL only when new config data has acl mapping, otherwise just reselect alert level """
+        data = args[0] if args else kwargs.get('data')
+        if self.acl_index is None or (isinstance(data, dict) and 'acl' in data):
+            return self.refresh_access_list()
+        return self.select_access_list()
+
+    def flush(self, sync: bool = False):
+        """ Write changes kept in memory by write-behind mode, sync: fsync config file """
+        with self._write_lock:
+            with self._data_lock:
+                if self._flush_timer:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self.dirty:
+                    return
+                data = dict(self.data)
+                self.dirty = False
+                # acl mapping is written outside of lock, next delta changes a copy
+                self._acl_owned = None
+            try:
+                self.write(data)
+                if sync:
+                    with open(self.config_path, 'rb+') as fh:
+                        os.fsync(fh.fileno())
+            except Exception:
+                self.dirty = True
+                logging.exception(f'failed to write {self.config_path}')
+
+    def _save_later(self, data: Optional[dict]):
+        with self._data_lock:
+            if data and data is not self.data:
+                super().update(data)
+            self.dirty = True
+            if not self._flush_timer:
+                # timer is not postponed by later saves, so delay is bounded
+                self._flush_timer = th.Timer(self.flush_delay, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def publish(self) -> ConfigSnapshot:
+        """ Swap snapshot with a new one built from current config data """
+        with self._publish_lock:
+            self.version += 1
+            self.snapshot = ConfigSnapshot(self.version, self.snapshot_data(), self.parsed_acl)
+        return self.snapshot
+
+    def snapshot_data(self) -> dict:
+        return self.data
+
+    def subscribe(self, callback: Callable):
+        """Register callback to be called after every config change"""
+        self.listeners.append(callback)
+
+    def notify(self):
+        for callback in self.listeners:
+            try:
+                callback()
+            except Exception:
+                logging.exception(f'config listener {callback} failed')
+
+    def update(self, *args, **kwargs):
+        args, kwargs = self._take_acl_delta(args, kwargs)
+        args, kwargs = self._take_acl(args, kwargs)
+        with self._data_lock:
+            result = super().update(*args, **kwargs)
+        self._refresh(args, kwargs)
+        self.publish()
+        self.notify()
         return result
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.gen_access_list()
+        args, kwargs = self._take_acl_delta(args, kwargs)
+        args, kwargs = self._take_acl(args, kwargs)
+        if self.flush_delay is None:
+            with self._data_lock:
+                self._acl_owned = None
+            super().save(*args, **kwargs)
+        else:
+            self._save_later(args[0] if args else kwargs.get('data'))
+        self._refresh(args, kwargs)
+        self.publish()
+        self.notify()
 
     def load(self, *args, **kwargs):
         super().load(*args, **kwargs)
-        self.gen_access_list()
+        if self.acl_path and self.get('acl'):
+            # acl mapping left in config file, move it to ACL file
+            acl = self.data['acl']
+            self.data['acl'] = {}
+            self.compile_access_list(acl)
+            super().save()
+        self.refresh_access_list()
+        self.publish()
+        self.notify()
+
+
+class DoorConfig(LockConfig):
+
+    """ State of additional door driven by the same lock process
+
+        Door keeps its own closed state, ACL index and DOOR_SHARED settings are taken from main lock config.
+    """
+
+    def __init__(self, config_path: str, main: LockConfig):
+        self.main = main
+        super().__init__(config_path, flush_delay=main.flush_delay)
+        main.subscribe(self._on_main_change)
+
+    def get(self, key, default=None):
+        if key in DOOR_SHARED:
+            return self.main.get(key, default)
+        return super().get(key, default)
+
+    def gen_access_list(self) -> frozenset:
+        self.main.access_list  # main index is built on first use
+        self.acl_index = self.main.acl_index
+        return self.select_access_list()
+
+    def refresh_access_list(self) -> frozenset:
+        if self.acl_index is not self.main.acl_index:
+            return self.gen_access_list()
+        return self.select_access_list()
+
+    def snapshot_data(self) -> dict:
+        data = dict(self.data)
+        data.update((key, self.main.data[key]) for key in DOOR_SHARED if key in self.main.data)
+        return data
+
+    def _on_main_change(self):
+        self.refresh_access_list()
+        self.publish()
+        self.notify()
@@ -1,58 +1,132 @@
-import pygame as pg
+import os
+import json
 import serial
+import signal
 import logging
 import time
 import threading as th
 
-from typing import Union, Optional
-from queue import Queue
+from typing import Callable, Union, Optional
+from collections import deque
+from queue import Queue, Empty
 
-import wiringpi as wpi
 from skabenclient.helpers import make_event
-from skabenclient.loaders import SoundLoader
 from skabenclient.device import BaseDevice
 from skabenclient.config import SystemConfig
+from audit import ACCESS_DENIED, ACCESS_GRANTED, AUDIT_CAPACITY, AuditLog
+from capture import CaptureWriter
+from comport import FALLBACK_PORTS, SERIAL_TIMEOUT, SerialLink
 from config import LockConfig
-
-try:
-    pg.mixer.pre_init()
-except Exception:
-    logging.exception('pre-init mixer failed: ')
-
+from gpio import make_gpio
+from heartbeat import HEARTBEAT_INTERVAL, LAG_BUDGET, STALL_TIMEOUT, Watchdog, sd_notify
+from logs import RATE_LIMITED, log_fields
+from keypad import CARD_EVENT, KBD_EVENT, DEBOUNCE_WINDOW, CardDebounce, CodeTrie, Frame, FrameReader, KeypadEntry
+from metrics import Metrics, PhaseTimer, Trace
+from outbox import BrokerProbe, EventOutbox
+from scheduler import Scheduler
+from sound import SOUND_CACHE_MB, SoundPlayer
 
 DEFAULT_SLEEP = .5  # 500ms
 SOUND_FADEOUT = 300  # 300ms
-SERIAL_TIMEOUT = 1
+SOUNDS = ('granted', 'denied', 'on', 'off', 'field')  # preloaded first
 DEFAULT_TIMER_TIME = 10
+ENTRY_TIMEOUT = 10  # seconds half-typed code is kept, 0 to keep it until * or #
+METRICS_INTERVAL = 300  # seconds between latency summaries sent to server, 0 to disable
+OUTBOX_SPOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conf', 'outbox.spool')
+
+# named timers
+MAIN_TIMER = 'main'  # lock auto-close
+ENTRY_TIMER = 'entry'  # keypad entry cleanup
+METRICS_TIMER = 'metrics'
+HEARTBEAT_TIMER = 'heartbeat'
 
-CARD_EVENT = 'CD'
-KBD_EVENT = 'KB'
+# main loop event kinds
+SERIAL_EVENT = 'serial'
+CONFIG_EVENT = 'config'
+WAKEUP_EVENT = 'wakeup'
+SOUND_EVENT = 'sound'
 
 
 class LockDevice(BaseDevice):
 
     """ Smart Lock device """
 
-    result = ''  # read from serial
-    serial_lock = None
     snd = None  # sound module
     closed = None
+    opening = None  # scheduled relay opening
+    sound_version = None  # config snapshot version sound settings were applied from
+    trace = None  # hot path trace of keypad input being processed
     running = None
+    dump_requested = False  # metrics dump asked by SIGUSR1, done by main loop
+    door = None  # name of additional door, None for main lock
+    door_id = 0  # door number in audit log
+    serial_mux = None  # keypads I/O thread shared by doors, see doors.setup_doors
     config_class = LockConfig
 
-    def __init__(self, system_config: SystemConfig, device_config: LockConfig):
+    def __init__(self, system_config: SystemConfig, device_config: LockConfig, shared: Optional['LockDevice'] = None):
+        """ shared: lock whose GPIO backend, watchdog, keypad capture, audit log and event outbox
+                    are used by this one
+        """
         super().__init__(system_config, device_config)
+        self.boot = PhaseTimer()
         self.port = None
         self.keypad_thread = None
-        self.keypad_data_queue = Queue()
-        self.timers = {}
+        self.doors = []  # additional doors driven by this process
+        self.event_queue = Queue()  # (kind, payload, monotonic timestamp)
+        self.metrics = Metrics()
+        self.scheduler = Scheduler(wakeup=self._wakeup)
+        self.busy_until = 0  # when already scheduled user feedback ends
+        self.input_hold = None  # scheduled input release
+        self.deferred = deque()  # serial events received while input is held
+        self.entry = KeypadEntry()  # code being typed on keypad
+        self.entry_trie = (None, None)  # (access list, its CodeTrie)
+        self.debounce = CardDebounce(window=system_config.get('debounce_window', DEBOUNCE_WINDOW),
+                                     metrics=self.metrics)
         # set config values (without gorillas, bananas and jungles)
         self.pin = system_config.get('pin')
         self.alert = system_config.get('alert')
-        self.preferred_serial = system_config.get('comport', '/dev/ttyS1')
-        # set sound
-        self.snd = self._snd_init(system_config.get('sound_dir'))
-        self.logger.debug(f'{self.config.get("acl")}')
+        # configured comport first, then fallback ports which are probed in order
+        self.link = SerialLink([system_config.get('comport', '/dev/ttyS1')]
+                               + list(system_config.get('comport_fallback', FALLBACK_PORTS)),
+                               metrics=self.metrics)
+        self.metrics_interval = system_config.get('metrics_interval', METRICS_INTERVAL)
+        self.entry_timeout = system_config.get('entry_timeout', ENTRY_TIMEOUT)
+        # reject code as soon as typed prefix is unknown, tells players which prefixes are valid
+        self.entry_reject = system_config.get('entry_reject', False)
+        self.entry_autosubmit = system_config.get('entry_autosubmit', False)  # submit unambiguous code without #
+        if shared:
+            self.gpio = shared.gpio
+            self.watchdog = shared.watchdog
+            self.capture = shared.capture
+            self.audit = shared.audit
+            self.outbox = shared.outbox
+        else:
+            self._setup_io(system_config)
+        # sound is loaded in background after lock is armed, see start_sound
+        self.sound_thread = None
+        self.logger.debug('acl: %s', self.config.get('acl'))
+        # wake main loop on config changes coming from skabenclient router
+        self.config.subscribe(self._on_config_change)
+        self.boot.mark('init')
+
+    def _setup_io(self, system_config: SystemConfig):
+        self.gpio = make_gpio(system_config.get('gpio', 'wiringpi'), self.metrics)
+        self.watchdog = Watchdog(self.metrics,
+                                 budget=system_config.get('lag_budget', LAG_BUDGET),
+                                 stall=system_config.get('stall_timeout', STALL_TIMEOUT))
+        # raw keypad input is recorded for replay when serial_capture path is set
+        capture_path = system_config.get('serial_capture')
+        self.capture = CaptureWriter(capture_path) if capture_path else None
+        # access history kept on device, see `python -m audit`
+        self.audit = None
+        if system_config.get('audit_log'):
+            self.audit = AuditLog(system_config.get('audit_log'), system_config.get('audit_capacity', AUDIT_CAPACITY))
+        # access events are delivered by outbox worker, spooled to disk while broker is down
+        self.outbox = EventOutbox(sender=self._send_events,
+                                  spool_path=system_config.get('outbox_spool', OUTBOX_SPOOL),
+                                  online=BrokerProbe(system_config.get('broker_ip'),
+                                                     system_config.get('broker_port', 1883)),
+                                  metrics=self.metrics)
 
     def on_start(self):
         """initialize serial listener, reload device"""
@@ -62,11 +136,15 @@ class LockDevice(BaseDevice):
             except Exception as e:
                 self.logger.exception(f'gpio_setup failed, cannot start device:\n{e}')
                 raise
-
-        self.keypad_thread = th.Thread(target=self._serial_read,
-                                       name='serial read Thread',
-                                       args=(self.port, self.keypad_data_queue,))
-        self.keypad_thread.daemon = True
+        self.start_sound()
+        self.outbox.start()
+        self._schedule_report()
+        self._heartbeat()
+        self.watchdog.start()
+        try:
+            signal.signal(signal.SIGUSR1, self._request_dump)
+        except ValueError:
+            self.logger.warning('not in main thread, metrics dump on SIGUSR1 disabled')
 
     def run(self):
         """ Running lock
@@ -74,42 +152,220 @@ class LockDevice(BaseDevice):
             self.gpio_setup() must be performed before run
         """
         self.on_start()
-        self.logger.info('running lock...')
-        start_event = make_event('device', 'reload')
-        self.q_int.put(start_event)
+        self.logger.info(f'running {self.door or "lock"}...')
+        if self.door:
+            # server config is applied by main lock, door starts from its saved state
+            self.reset()
+        else:
+            start_event = make_event('device', 'reload')
+            self.q_int.put(start_event)
         self.running = True
-        self.keypad_thread.start()
+        self.listen_keypad()
+        for door in self.doors:
+            door.start()
+        self.boot.mark('start')
+        self.logger.info(f'boot phases: {self.boot.report()}')
+        self.metrics.gauge('boot.running', self.boot.elapsed())
+        sd_notify('READY=1')
 
         while self.running:
-            time.sleep(DEFAULT_SLEEP / 5)
+            # sleep until keypad input, config change or nearest timer deadline
+            try:
+                event = self.event_queue.get(timeout=self._wait_timeout())
+            except Empty:
+                event = None
+            self.metrics.incr('loop.wakeups')
+            self._dump_metrics()
             # main routine
             self.manage_sound()
             # Это должно быть сверху, потому что иначе неправильно работает игровой фидбек от замка в blocked статусе
-            if not self.keypad_data_queue.empty():
-                # reading serial from keypads.
-                data = self.keypad_data_queue.get()
-                self.parse_data(data)
-            # blocked rules all
-            if self.config.get('blocked') or self.check_timer("main", int(time.time())):
-                self.set_closed()
-                continue
-            # sync state - opening
-            if self.closed and not self.config.get('closed'):
-                self.open()
-            # sync state - closing
-            if not self.closed and self.config.get('closed'):
-                self.close()
+            self.scheduler.run_due()
+            if event:
+                self.handle_event(event)
+            self.sync_state()
+            if event:
+                kind, _, stamp = event
+                self.metrics.observe(f'event.{kind}', time.monotonic() - stamp)
         else:
             return self.stop()
 
+    def listen_keypad(self):
+        """ Start delivering keypad frames to main loop """
+        if self.serial_mux:
+            self.serial_mux.register(self.port, self._on_frame, self.metrics, self.capture, self._on_serial_lost)
+            self.serial_mux.start()
+            return
+        self.keypad_thread = th.Thread(target=self._serial_read,
+                                       name='serial read Thread',
+                                       args=(self.port, self.event_queue,))
+        self.keypad_thread.daemon = True
+        self.keypad_thread.start()
+
+    def post(self, kind: str, payload=None, stamp: Optional[float] = None):
+        """ Pass event to main loop, could be called from any thread """
+        self.event_queue.put((kind, payload, stamp or time.monotonic()))
+
+    def handle_event(self, event: tuple):
+        """ Dispatch main loop event """
+        kind, payload, _ = event
+        if kind == SOUND_EVENT:
+            self._sound_ready(payload)
+        elif kind == SERIAL_EVENT:
+            # debounced once on arrival, deferred input is not checked again on release
+            if not self.debounce.accept(payload):
+                # card is still on the reader
+                return
+            self._handle_serial(event)
+        elif kind == CONFIG_EVENT:
+            # keypad trie for new ACL is built before next keypad input, by the thread reading it
+            self._code_trie()
+        # config changes are applied by sync_state
+
+    def _handle_serial(self, event: tuple):
+        _, frame, _ = event
+        if self.input_hold:
+            # user feedback in progress, keypad input will be processed after
+            self.deferred.append(event)
+            return
+        self.trace = Trace(self.metrics, frame.stamp)
+        self.trace.mark('queue')
+        try:
+            # reading serial from keypads.
+            self.parse_data(frame.raw)
+        finally:
+            self.trace = None
+
+    def sync_state(self):
+        """ Sync GPIO state with device config """
+        conf = self.config.snapshot
+        # blocked rules all
+        if conf.blocked:
+            self.set_closed()
+            return
+        # sync state - opening
+        if self.closed and not conf.closed:
+            self.open()
+        # sync state - closing
+        if not self.closed and conf.closed:
+            self.close()
+
+    def schedule_feedback(self, delay: float, callback: Callable, *args):
+        """ Schedule action `delay` seconds after already scheduled user feedback ends """
+        due = max(self.busy_until, self.scheduler.clock()) + delay
+        self.busy_until = due
+        return self.scheduler.call_at(due, callback, *args)
+
+    def hold_input(self, delay: float, clean: Optional[bool] = True):
+        """ Defer keypad input until `delay` seconds after scheduled user feedback ends """
+        if self.input_hold:
+            self.input_hold.cancel()
+        self.input_hold = self.schedule_feedback(delay, self._release_input, clean)
+
+    def _release_input(self, clean: bool):
+        self.input_hold = None
+        if clean:
+            self._serial_clean()
+        while self.deferred and not self.input_hold:
+            self._handle_serial(self.deferred.popleft())
+
+    def _wait_timeout(self) -> Optional[float]:
+        """ Seconds left until the nearest timer or scheduled action, None if nothing pending """
+        return self.scheduler.timeout()
+
+    def _on_config_change(self):
+        if self.config.resync_needed:
+            # ACL delta could not be applied, full config is requested the same way as on start
+            self.config.resync_needed = False
+            self.q_int.put(make_event('device', 'reload'))
+        self.post(CONFIG_EVENT)
+
+    def report_metrics(self):
+        """ Send compact hot path latency summary to server """
+        self.send_message({
+            "type": "latency",
+            "content": self.metrics.summary('trace.'),
+            "lag": self.metrics.summary('lag.'),
+            "serial": self.metrics.summary('serial.recover'),
+        })
+
+    def _heartbeat(self, due: Optional[float] = None):
+        """ Main loop heartbeat, lag is how late the heartbeat timer was run """
+        if due is not None:
+            self.watchdog.beat(self._source('loop'), self.scheduler.clock() - due)
+        # idle loop is woken up at least by heartbeat
+        self._dump_metrics()
+        self.scheduler.set_timer(HEARTBEAT_TIMER, HEARTBEAT_INTERVAL, self._heartbeat,
+                                 self.scheduler.clock() + HEARTBEAT_INTERVAL)
+
+    def _source(self, name: str) -> str:
+        return f'{name}.{self.door}' if self.door else name
+
+    def _send_events(self, events: list):
+        for event in events:
+            self.send_message(event)
+
+    def _schedule_report(self):
+        if self.metrics_interval > 0:
+            self.scheduler.set_timer(METRICS_TIMER, self.metrics_interval, self._report)
+
+    def _report(self):
+        self.report_metrics()
+        self._schedule_report()
+
+    def _request_dump(self, signum, frame):
+        # signal handler interrupts main thread anywhere, even holding metrics lock, so it only sets a flag
+        self.dump_requested = True
+
+    def _dump_metrics(self):
+        if self.dump_requested:
+            self.dump_requested = False
+            self.logger.info(f'metrics: {json.dumps(self.metrics.snapshot())}')
+
+    def _trace(self, stage: str):
+        if self.trace:
+            self.trace.mark(stage)
+
+    def start_sound(self):
+        """ Load pygame and sounds in background thread, lock works without sound meanwhile """
+        if self.snd or self.sound_thread:
+            return
+        self.sound_thread = th.Thread(target=self._snd_load,
+                                      name='sound init Thread',
+                                      daemon=True)
+        self.sound_thread.start()
+
+    def _snd_load(self):
+        started = time.monotonic()
+        snd = self._snd_init(self.system.get('sound_dir'),
+                             self.system.get('sound_cache_mb', SOUND_CACHE_MB))
+        elapsed = time.monotonic() - started
+        self.boot.record('sound', elapsed)
+        self.metrics.gauge('boot.sound', elapsed)
+        self.logger.info(f'sound init took {elapsed:.3f}s, {self.boot.elapsed():.3f}s since boot')
+        if snd:
+            self.post(SOUND_EVENT, snd)
+
+    def _sound_ready(self, snd: SoundPlayer):
+        """ Start using sound module initialized in background """
+        self.snd = snd
+        self.snd.enabled = self.config.get('sound')
+        if self.closed and self.sound_enabled:
+            # lock was armed silently, start field sound
+            self.snd.loop(sound='field', channel='bg')
+        for door in self.doors:
+            door.post(SOUND_EVENT, snd)
+
+    def _wakeup(self):
+        self.post(WAKEUP_EVENT)
+
     def reset(self):
         """ Resetting from saved config """
-        self.logger.debug(f"running with config: {self.config.data}")
+        self.logger.debug('running with config: %s', self.config.data)
         try:
             if self.snd:
                 self.snd.enabled = self.config.get('sound')
             if not self.config.get('closed'):
-                self.timers = {}  # drop timer
+                self.scheduler.cancel_timer(MAIN_TIMER)  # drop timer
                 self.open()
             else:
                 self.close()
@@ -118,103 +374,147 @@ class LockDevice(BaseDevice):
 
     def stop(self):
         """ Full stop """
-        wpi.digitalWrite(self.pin, False)
+        self.gpio.write(self.pin, False)
+        for door in self.doors:
+            door.gpio.write(door.pin, False)
+            door.config.flush(sync=True)
+        self.config.flush(sync=True)
+        if self.audit:
+            self.audit.close()
+        self.outbox.close()
+        self.link.close()
         raise SystemExit
 
     def open(self):
-        """Open lock low-level operation"""
-        if self.closed:
+        """Open lock low-level operation, relay is switched after field shutdown sound"""
+        if self.closed and not self.opening:
             if self.sound_enabled:
                 self.snd.fadeout(SOUND_FADEOUT * 4, 'bg')
                 self.snd.play(sound='off', channel='fg', delay=DEFAULT_SLEEP * 3)
-            time.sleep(DEFAULT_SLEEP * 2)
-            wpi.digitalWrite(self.pin, False)
-            self.closed = False  # state of GPIO
-            # additional field sound check
-            if self.sound_enabled:
-                self.snd.stop('bg')
+            self.opening = self.schedule_feedback(DEFAULT_SLEEP * 2, self._open_relay, self.trace)
             return 'open lock'
 
+    def _open_relay(self, trace: Optional[Trace] = None):
+        self.opening = None
+        self.gpio.write(self.pin, False)
+        if trace:
+            # includes DEFAULT_SLEEP * 2 of field shutdown feedback
+            trace.finish('relay')
+        self.closed = False  # state of GPIO
+        # additional field sound check
+        if self.sound_enabled:
+            self.snd.stop('bg')
+
     def close(self):
         """Close lock low-level operation"""
+        if self.opening:
+            # closing while relay opening is scheduled
+            self.opening.cancel()
+            self.opening = None
+            self.closed = False
         if not self.closed:
             if self.sound_enabled:
                 self.snd.play(sound='on', channel='fg', delay=DEFAULT_SLEEP)
-                self.snd.play(sound='field', channel='bg', delay=DEFAULT_SLEEP * 2, loops=-1, fade_ms=SOUND_FADEOUT * 4)
-            wpi.digitalWrite(self.pin, True)
+                self.snd.loop(sound='field', channel='bg', delay=DEFAULT_SLEEP * 2, fade_ms=SOUND_FADEOUT * 4)
+            self.gpio.write(self.pin, True)
+            if self.trace:
+                self.trace.finish('relay')
             self.closed = True  # state of GPIO
             return 'close lock'
 
     def set_opened(self, timer: Optional[bool] = None, code: Optional[str] = None):
         """Open lock with config update and timer"""
+        self._trace('set_opened')
         if self.open():
-            self.timers = {}  # resetting timers
+            self.scheduler.cancel_timer(MAIN_TIMER)  # resetting timer
             if code:
-                self.logger.info(f"[---] OPEN by {code}")
+                self.logger.info('[---] OPEN by %s', code)
             if timer:
-                from_now = int(time.time())
-                plus_seconds = self.config.get('timer', DEFAULT_TIMER_TIME)
-                if plus_seconds > 0:
-                    self.new_timer(from_now, plus_seconds, "main")
+                # count from the moment relay actually opens
+                self.schedule_feedback(0, self._start_timer)
             return self.state_update({"closed": False})
 
+    def _start_timer(self):
+        if self.closed:
+            return
+        plus_seconds = self.config.get('timer', DEFAULT_TIMER_TIME)
+        if plus_seconds > 0:
+            self.scheduler.set_timer(MAIN_TIMER, plus_seconds, self.set_closed)
+
     def set_closed(self, code: Optional[str] = 'system'):
         """Close lock with config update"""
         if self.close():
-            self.timers = {}
-            self.logger.info(f"[---] CLOSE by {code}")
+            self.scheduler.cancel_timer(MAIN_TIMER)
+            self.logger.info('[---] CLOSE by %s', code)
             return self.state_update({'closed': True})
 
     def access_granted(self, code: str):
         """Direct User Interaction access granted"""
+        self._trace('access_granted')
         if self.sound_enabled:
             self.snd.play(sound='granted', channel='fg')
-        self.send_message({
-            "type": "access",
-            "content": f"{code}",
-            "success": True,
-        })
+        self._audit(ACCESS_GRANTED, code)
+        self._log_access(code, True)
+        self.outbox.put(self._access_event(code, True))
         return self.set_opened(timer=True, code=code)
 
     def access_denied(self, code: Optional[str] = None):
         """Direct User Interaction access denied"""
+        self._trace('access_denied')
         if self.sound_enabled:
             self.snd.play(sound='denied', channel='fg')
         if code:
-            self.logger.info(f"[---] DENIED to {code}")
-            self.send_message({
-                "type": "access",
-                "content": f"{code}",
-                "success": False
-            })
-        time.sleep(DEFAULT_SLEEP)
-        return self.set_closed()
+            self._audit(ACCESS_DENIED, code)
+            self._log_access(code, False)
+            self.outbox.put(self._access_event(code, False))
+        self.schedule_feedback(DEFAULT_SLEEP, self.set_closed)
+
+    def _audit(self, event: int, code: str):
+        if not self.audit:
+            return
+        latency = time.monotonic() - self.trace.started if self.trace else 0
+        try:
+            self.audit.append(event, code, int(self.config.snapshot.alert), latency, self.door_id)
+        except Exception:
+            self.logger.exception('failed to write audit log')
+
+    def _log_access(self, code: str, success: bool):
+        log_fields(self.logger, logging.INFO, '[---] ACCESS',
+                   code=code, success=success, alert=self.config.snapshot.alert, door=self.door)
+
+    def _access_event(self, code: str, success: bool) -> dict:
+        event = {
+            "type": "access",
+            "content": f"{code}",
+            "success": success,
+        }
+        if self.door:
+            event["door"] = self.door
+        return event
 
     def check_access(self, code: str):
         """ Check id (code or card number) """
-        self.logger.debug(f'checking id: {code}')
+        self.logger.debug('checking id: %s', code)
+        conf = self.config.snapshot
         try:
             # in blocked state lock should ignore everything
-            if self.config.get('blocked'):
-                time.sleep(DEFAULT_SLEEP)
-                self._serial_clean()
+            if conf.blocked:
+                self.hold_input(DEFAULT_SLEEP)
                 return
             # in opened state lock should close on every code
-            if not self.config.get('closed'):
+            if not conf.closed:
                 return self.set_closed(code)
 
-            acl = self.config.access_list
-
-            if code in acl:
+            self._trace('check_access')
+            if code in conf.access_list:
                 return self.access_granted(code)
             else:
                 return self.access_denied(code)
         except Exception:
-            logging.exception(f'while checking id: {code}')
+            self.logger.exception('while checking id: %s', code)
             return self.access_denied(code)
         finally:
-            time.sleep(DEFAULT_SLEEP)
-            self._serial_clean()
+            self.hold_input(DEFAULT_SLEEP)
 
     def parse_data(self, serial_data: bin):
         """ Parse data from keypad """
@@ -223,23 +523,24 @@ class LockDevice(BaseDevice):
             if not data:
                 return
         except Exception:
-            self.logger.exception(f'cannot decode serial: {serial_data}')
+            self.logger.exception('cannot decode serial: %r', serial_data, extra=RATE_LIMITED)
             self.access_denied()
-            time.sleep(DEFAULT_SLEEP * 10)
+            self.hold_input(DEFAULT_SLEEP * 10, clean=False)
             return
 
         try:
             input_type = str(data[2:4])  # keyboard or card
             input_data = str(data[4:]).strip()  # code entered/readed
 
-            self.logger.debug(f'serial data parsed as: {self.result} --- {input_data} {input_type}')
+            self.logger.debug('serial data parsed as: %s --- %s %s', self.result, input_data, input_type)
+            self._trace('parse_data')
 
-            if self.config.get('closed'):
+            if self.config.snapshot.closed:
                 self.check_on_input_when_closed(input_type, input_data)
             else:
                 self.close_on_input_when_opened(input_type, input_data)
         except Exception:
-            self.logger.exception('while operating with controller:')
+            self.logger.exception('while operating with controller:', extra=RATE_LIMITED)
 
     def check_on_input_when_closed(self, input_type: str, input_data: str):
         asterisk_button = '10'
@@ -253,15 +554,45 @@ class LockDevice(BaseDevice):
                         if self.sound_enabled:
                             self.snd.play(sound='denied', channel='fg')
                 else:
-                    self.result += input_data
+                    self._enter_digit(input_data)
             else:
                 self._serial_clean()
         elif input_type == CARD_EVENT:
-            if self.serial_lock:
-                return
-            self.serial_lock = True
             self.check_access(input_data)
 
+    def _enter_digit(self, digit: str):
+        if not self.entry.digits:
+            self.entry.reset(self._code_trie())
+        possible = self.entry.push(digit)
+        if self.entry_timeout > 0:
+            self.scheduler.set_timer(ENTRY_TIMER, self.entry_timeout, self._serial_clean)
+        if not possible and self.entry_reject:
+            # no code starts with digits typed, no need to wait for #
+            self._reject_entry()
+        elif self.entry_autosubmit and self.entry.unambiguous:
+            self.check_access(self.result)
+
+    def _reject_entry(self):
+        """ Denied feedback for partial code, it's not an access attempt, so it's not reported or audited """
+        self.metrics.incr('input.entries_rejected')
+        if self.sound_enabled:
+            self.snd.play(sound='denied', channel='fg')
+        self.hold_input(DEFAULT_SLEEP)
+
+    def _code_trie(self) -> Optional[CodeTrie]:
+        """ Keypad codes trie for current access list, rebuilt when access list changes """
+        access_list = self.config.snapshot.access_list
+        source, trie = self.entry_trie
+        if access_list is not source:
+            trie = CodeTrie.build(access_list)
+            self.entry_trie = (access_list, trie)
+        return trie
+
+    @property
+    def result(self) -> str:
+        """ Code typed on keypad """
+        return self.entry.code
+
     def close_on_input_when_opened(self, input_type: str, input_data: str):
         if input_type == KBD_EVENT:
             # close on # button
@@ -270,9 +601,6 @@ class LockDevice(BaseDevice):
                     self.snd.play('denied', 'fg')
                 self.set_closed()
         elif input_type == CARD_EVENT:
-            if self.serial_lock:
-                return
-            self.serial_lock = True
             if self.sound_enabled:
                 self.snd.play('denied', 'fg')
             self.set_closed()
@@ -305,7 +633,13 @@ class LockDevice(BaseDevice):
         if not self.snd:
             return
 
-        sound = self.config.get("sound")
+        conf = self.config.snapshot
+        if conf.version == self.sound_version:
+            # nothing changed since last check
+            return
+        self.sound_version = conf.version
+
+        sound = conf.sound
         if sound and not self.snd.enabled:
             self.sound_on()
         elif not sound and self.snd.enabled:
@@ -313,59 +647,88 @@ class LockDevice(BaseDevice):
         else:
             return
 
-        if self.config.get('closed'):
-            # play field sound without interrupts
-            if self.sound_enabled and not self.snd.channels['bg'].get_busy():
-                self.snd.play(sound='field', channel='bg', loops=-1)
-
-    def connect_serial(self):
-        self.logger.debug(f"Connecting to serial {self.preferred_serial}...")
-        port = serial.Serial(self.preferred_serial, timeout=SERIAL_TIMEOUT)
-        port.baudrate = 9600
-        time.sleep(DEFAULT_SLEEP)
-        if port:
-            return port
-        else:
-            self.logger.debug(f'Failed to connect to serial {self.prefferred_serial}')
+        if conf.closed and self.sound_enabled:
+            # audio thread keeps field sound already looping without interrupts
+            self.snd.loop(sound='field', channel='bg')
+
+    def connect_serial(self) -> Optional[serial.Serial]:
+        """ Open the first available keypad port, waits for it with backoff """
+        self.logger.debug(f'connecting to serial {", ".join(self.link.candidates)}...')
+        return self.link.connect(idle=self._serial_idle)
 
     def gpio_setup(self):
-        """ Setup wiringpi GPIO """
-        port = None
-        wpi.wiringPiSetup()
-        wpi.pinMode(self.pin, 1)
-        wpi.digitalWrite(self.pin, 0)
-        while not port:
-            time.sleep(DEFAULT_SLEEP)
-            try:
-                port = self.connect_serial()
-            except Exception:
-                self.preferred_serial = 'dev/ttyAMA1'
-                port = self.connect_serial()
-
-        if port:
-            self.port = port
-            return self.port
-        else:
+        """ Setup relay GPIO and keypad serial port """
+        self.gpio.setup()
+        self.gpio.output(self.pin)
+        # arm lock according to saved state before anything else is loaded
+        armed = bool(self.config.get('closed', True) or self.config.get('blocked'))
+        self.gpio.write(self.pin, armed)
+        self.boot.mark('gpio')
+        self.port = self.connect_serial()
+        if not self.port:
             raise Exception('no serial port connection acquired, exiting')
+        self.boot.mark('serial')
+        return self.port
 
     def _serial_read(self, port: serial.Serial, queue: Queue):
         self.logger.debug('start listening serial: {}'.format(port))
-        while True:
-            serial_data = port.readline()
-            if serial_data and not self.serial_lock:
-                self.logger.debug(f'new data from serial: {serial_data}')
-                queue.put(serial_data)
+        reader = FrameReader(port, self.metrics, self.capture)
+        source = self._source('serial')
+        while not self.link.closed:
+            started = time.monotonic()
+            try:
+                frames = reader.read(SERIAL_TIMEOUT)
+            except (OSError, ValueError, TypeError) as e:
+                # pyserial raises TypeError reading port closed under it by stop()
+                if self.link.closed:
+                    return
+                frames = None
+                reason = str(e) or type(e).__name__
             else:
-                time.sleep(DEFAULT_SLEEP / 5)
+                reason = 'device node is gone' if not frames and self.link.stale() else None
+            if reason:
+                # partial frame from old port is dropped with its reader
+                port = self.link.reconnect(reason, idle=self._serial_idle)
+                if not port:
+                    return
+                self.port = port
+                reader = FrameReader(port, self.metrics, self.capture)
+                continue
+            self.watchdog.beat(source, max(0, time.monotonic() - started - SERIAL_TIMEOUT))
+            for frame in frames:
+                self._on_frame(frame, queue)
+
+    def _serial_idle(self):
+        """ Serial thread is waiting for keypad port, not stalled """
+        self.watchdog.beat(self._source('serial'))
+
+    def _on_serial_lost(self, port: serial.Serial, error: Exception):
+        """ Keypad port read by serial mux failed, it's registered again when reconnected """
+        def reconnect():
+            port = self.link.reconnect(str(error) or type(error).__name__)
+            if port:
+                self.port = port
+                self.serial_mux.register(port, self._on_frame, self.metrics, self.capture, self._on_serial_lost)
+
+        th.Thread(target=reconnect, name=f'serial reconnect {self.door or "lock"} Thread', daemon=True).start()
+
+    def _on_frame(self, frame: Frame, queue: Optional[Queue] = None):
+        self.logger.debug('new data from serial: %r', frame.raw)
+        if queue:
+            queue.put((SERIAL_EVENT, frame, frame.stamp))
+        else:
+            self.post(SERIAL_EVENT, frame, frame.stamp)
 
     def _serial_clean(self):
-        self.result = ''
-        self.serial_lock = None
+        self.entry.reset()
+        self.scheduler.cancel_timer(ENTRY_TIMER)
 
-    def _snd_init(self, sound_dir: str) -> Union[SoundLoader, None]:
-        # TODO: when init failed SoundLoader should return itself with disable=True
+    def _snd_init(self, sound_dir: str, cache_mb: int = SOUND_CACHE_MB) -> Union[SoundPlayer, None]:
+        # TODO: when init failed SoundPlayer should return itself with disable=True
         try:
-            snd = SoundLoader(sound_dir=sound_dir)
+            snd = SoundPlayer(sound_dir=sound_dir, max_bytes=cache_mb * 1024 * 1024, metrics=self.metrics)
+            snd.bank.preload_async(SOUNDS)
+            snd.bank.watch()
         except Exception:
             self.logger.exception('failed to initialize sound module')
             snd = None
@@ -0,0 +1,100 @@
+import os
+import threading as th
+
+from typing import List
+
+from skabenclient.config import SystemConfig
+
+from config import DoorConfig
+from device import LockDevice
+from keypad import SerialMux
+
+
+class DoorSystemConfig:
+
+    """ System config of additional door, values from door section override main lock ones """
+
+    def __init__(self, system_config: SystemConfig, door: dict):
+        self.system_config = system_config
+        self.door = door
+
+    def get(self, key, default=None):
+        if key in self.door:
+            return self.door[key]
+        return self.system_config.get(key, default)
+
+    def __getattr__(self, name):
+        return getattr(self.system_config, name)
+
+
+class DoorLockDevice(LockDevice):
+
+    """ Additional door driven by main lock process
+
+        Door has its own keypad port, relay pin, timers and closed state.
+        Serial I/O thread, GPIO backend, watchdog, event outbox and sound are shared with main lock.
+    """
+
+    def __init__(self, system_config: DoorSystemConfig, device_config: DoorConfig, name: str, main: LockDevice):
+        # all keypads are recorded to main lock capture, access events go to main lock audit log and outbox
+        super().__init__(system_config, device_config, shared=main)
+        self.door = name
+        self.door_id = len(main.doors) + 1
+        self.serial_mux = main.serial_mux
+
+    def state_update(self, data: dict):
+        """ Door state is not a device config on server, it's reported with door name """
+        self.config.save(data)
+        self.send_message(dict(data, type='door', door=self.door))
+        return data
+
+    def start_sound(self):
+        # main lock passes its sound module when it's loaded
+        pass
+
+    def start(self) -> th.Thread:
+        thread = th.Thread(target=self.run, name=f'door {self.door} Thread', daemon=True)
+        thread.start()
+        return thread
+
+
+def setup_doors(system_config: SystemConfig, main: LockDevice, conf_dir: str) -> List[DoorLockDevice]:
+    """ Create doors from `doors` section of system config, all keypads are read in one thread
+
+        doors:
+          - name: north
+            comport: /dev/ttyUSB0
+            pin: 12
+
+        name, comport and pin are required, door using port or pin of main lock or another door is skipped
+    """
+    doors = []
+    used = {'comport': {system_config.get('comport', '/dev/ttyS1')}, 'pin': {system_config.get('pin')}}
+    for door in system_config.get('doors') or []:
+        missing = [key for key in ('name', 'comport', 'pin') if door.get(key) is None]
+        if missing:
+            main.logger.error(f'door {door} skipped, missing: {", ".join(missing)}')
+            continue
+        # door falling back to main lock port or pin would drive main relay and read main keypad
+        taken = [key for key in ('comport', 'pin') if door[key] in used[key]]
+        if taken:
+            main.logger.error(f'door {door["name"]} skipped, {" and ".join(taken)} already used')
+            continue
+        for key in used:
+            used[key].add(door[key])
+        doors.append(door)
+    if not doors:
+        return []
+    main.serial_mux = SerialMux()
+    for door in doors:
+        name = str(door['name'])
+        config_path = os.path.join(conf_dir, f'door-{name}.yml')
+        if not os.path.exists(config_path):
+            open(config_path, 'a').close()
+        # latency summaries are sent by main lock only, fallback ports are probed by main lock only
+        door_system = DoorSystemConfig(system_config, dict({'metrics_interval': 0, 'comport_fallback': []}, **door))
+        main.doors.append(DoorLockDevice(door_system, DoorConfig(config_path, main.config), name, main))
+    # main lock never takes over door keypad when probing fallback ports
+    door_ports = set(door['comport'] for door in doors)
+    main.link.candidates = [path for path in main.link.candidates if path not in door_ports]
+    return main.doors
@@ -0,0 +1,149 @@
+""" Relay GPIO backends
+
+    Pin numbers are backend-native: wiringpi numbering for wiringpi, line offset on chip for gpiod,
+    kernel GPIO number for sysfs.
+"""
+import logging
+import os
+import time
+
+from typing import Callable, Optional
+
+from metrics import Metrics
+
+GPIOD_CHIP = 'gpiochip0'
+GPIOD_CONSUMER = 'skaben-lock'
+SYSFS_ROOT = '/sys/class/gpio'
+
+
+class GpioBackend:
+
+    """ Output pins with edge-only writes
+
+        Writing the value pin already has is skipped, edges and skipped writes are counted in metrics
+        as gpio.edges and gpio.skipped.
+    """
+
+    def __init__(self, metrics: Optional[Metrics] = None):
+        self.metrics = metrics or Metrics()
+        self.state = {}  # pin -> last written value
+
+    def setup(self):
+        """ Initialize backend, called once before pins are used """
+
+    def output(self, pin: int):
+        """ Configure pin as output """
+        raise NotImplementedError
+
+    def write(self, pin: int, value: bool) -> bool:
+        """ Set pin value, returns False if pin already had it """
+        value = bool(value)
+        if self.state.get(pin) is value:
+            self.metrics.incr('gpio.skipped')
+            return False
+        self._write(pin, value)
+        self.state[pin] = value
+        self.metrics.incr('gpio.edges')
+        return True
+
+    def _write(self, pin: int, value: bool):
+        raise NotImplementedError
+
+
+class WiringPiGpio(GpioBackend):
+
+    """ wiringpi library backend """
+
+    def setup(self):
+        import wiringpi
+        self.wpi = wiringpi
+        self.wpi.wiringPiSetup()
+
+    def output(self, pin: int):
+        self.wpi.pinMode(pin, 1)
+
+    def _write(self, pin: int, value: bool):
+        self.wpi.digitalWrite(pin, value)
+
+
+class GpiodGpio(GpioBackend):
+
+    """ GPIO character device backend, libgpiod python bindings (v1 API) """
+
+    def __init__(self, metrics: Optional[Metrics] = None, chip: str = GPIOD_CHIP):
+        super().__init__(metrics)
+        self.chip_name = chip
+        self.chip = None
+        self.lines = {}
+
+    def setup(self):
+        import gpiod
+        self.gpiod = gpiod
+        self.chip = gpiod.Chip(self.chip_name)
+
+    def output(self, pin: int):
+        if pin not in self.lines:
+            line = self.chip.get_line(pin)
+            line.request(consumer=GPIOD_CONSUMER, type=self.gpiod.LINE_REQ_DIR_OUT)
+            self.lines[pin] = line
+
+    def _write(self, pin: int, value: bool):
+        self.lines[pin].set_value(int(value))
+
+
+class SysfsGpio(GpioBackend):
+
+    """ Legacy /sys/class/gpio backend, value files are kept open """
+
+    def __init__(self, metrics: Optional[Metrics] = None, root: str = SYSFS_ROOT):
+        super().__init__(metrics)
+        self.root = root
+        self.values = {}  # pin -> value file descriptor
+
+    def output(self, pin: int):
+        pin_dir = os.path.join(self.root, f'gpio{pin}')
+        if not os.path.exists(pin_dir):
+            with open(os.path.join(self.root, 'export'), 'w') as fh:
+                fh.write(str(pin))
+        with open(os.path.join(pin_dir, 'direction'), 'w') as fh:
+            fh.write('out')
+        self.values[pin] = os.open(os.path.join(pin_dir, 'value'), os.O_WRONLY)
+
+    def _write(self, pin: int, value: bool):
+        os.pwrite(self.values[pin], b'1' if value else b'0', 0)
+
+
+class FakeGpio(GpioBackend):
+
+    """ In-memory backend recording every edge as (timestamp, pin, value) """
+
+    def __init__(self, metrics: Optional[Metrics] = None, clock: Callable = time.monotonic):
+        super().__init__(metrics)
+        self.clock = clock
+        self.outputs = set()
+        self.edges = []
+
+    def output(self, pin: int):
+        self.outputs.add(pin)
+
+    def _write(self, pin: int, value: bool):
+        self.edges.append((self.clock(), pin, value))
+
+    def toggles(self, pin: int) -> int:
+        return sum(1 for _, edge_pin, _ in self.edges if edge_pin == pin)
+
+
+BACKENDS = {
+    'wiringpi': WiringPiGpio,
+    'gpiod': GpiodGpio,
+    'sysfs': SysfsGpio,
+    'fake': FakeGpio,
+}
+
+
+def make_gpio(name: str = 'wiringpi', metrics: Optional[Metrics] = None) -> GpioBackend:
+    backend = BACKENDS.get(name)
+    if not backend:
+        logging.error(f'unknown GPIO backend {name}, using wiringpi')
+        backend = WiringPiGpio
+    return backend(metrics)
@@ -0,0 +1,119 @@
+""" Lock threads heartbeat monitor and systemd watchdog notifications """
+import logging
+import os
+import socket
+import sys
+import threading as th
+import time
+import traceback
+
+from typing import Callable, Optional, Tuple
+
+from metrics import Metrics
+
+HEARTBEAT_INTERVAL = 5  # seconds between main loop heartbeats
+LAG_BUDGET = 1  # seconds of scheduling lag lock is considered healthy with
+STALL_TIMEOUT = 15  # seconds without heartbeat thread is considered stalled
+NOTIFY_INTERVAL = 10  # seconds between watchdog checks when systemd doesn't set WATCHDOG_USEC
+
+
+def sd_notify(state: str) -> bool:
+    """ Send state to systemd notify socket, False if lock is not run by systemd """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        # abstract namespace socket
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(state.encode(), address)
+        return True
+    except OSError:
+        logging.exception('systemd notify failed')
+        return False
+
+
+def notify_interval() -> float:
+    """ Half of systemd watchdog timeout, so one missed check doesn't kill the lock """
+    usec = os.environ.get('WATCHDOG_USEC')
+    if usec and usec.isdigit():
+        return int(usec) / 2000000
+    return NOTIFY_INTERVAL
+
+
+class Watchdog:
+
+    """ Tracks heartbeats of lock threads, pets systemd watchdog only while all of them are healthy
+
+        Every source (main loop, serial reader) reports its scheduling lag with beat(),
+        lag is kept in metrics as lag.<source> histogram.
+        Source is stalled if it hasn't beaten for `stall` seconds, stacks of all threads are logged then.
+    """
+
+    def __init__(self,
+                 metrics: Optional[Metrics] = None,
+                 budget: float = LAG_BUDGET,
+                 stall: float = STALL_TIMEOUT,
+                 notify: Callable = sd_notify,
+                 clock: Callable = time.monotonic):
+        self.metrics = metrics or Metrics()
+        self.budget = budget
+        self.stall = stall
+        self.notify = notify
+        self.clock = clock
+        self.beats = {}  # source -> (monotonic time of last beat, lag)
+        self.stalled = False
+        self.thread = None
+
+    def beat(self, source: str, lag: float = 0):
+        self.beats[source] = (self.clock(), lag)
+        self.metrics.observe(f'lag.{source}', lag)
+
+    def problems(self) -> Tuple[list, list]:
+        """ Sources which are stalled and sources which last lag was over budget """
+        now = self.clock()
+        stalled, lagging = [], []
+        for source, (last, lag) in list(self.beats.items()):
+            if now - last > self.stall:
+                stalled.append(f'{source} stalled for {now - last:.1f}s')
+            elif lag > self.budget:
+                lagging.append(f'{source} lag {lag:.3f}s')
+        return stalled, lagging
+
+    def check(self) -> bool:
+        stalled, lagging = self.problems()
+        if not stalled and not lagging:
+            self.stalled = False
+            self.notify('WATCHDOG=1')
+            return True
+        self.metrics.incr('watchdog.missed')
+        if stalled and not self.stalled:
+            # thread is stuck right now, its stack shows where; dumped once per stall
+            self.stalled = True
+            logging.error(f'lock is stalled: {", ".join(stalled)}\n{self.dump_stacks()}')
+        elif lagging:
+            logging.warning(f'lock is lagging: {", ".join(lagging)}')
+        return False
+
+    def start(self, interval: Optional[float] = None):
+        if not self.thread:
+            self.thread = th.Thread(target=self._run, args=(interval or notify_interval(),),
+                                    name='watchdog Thread', daemon=True)
+            self.thread.start()
+
+    def _run(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.check()
+            except Exception:
+                logging.exception('watchdog check failed')
+
+    @staticmethod
+    def dump_stacks() -> str:
+        names = {thread.ident: thread.name for thread in th.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            stacks.append(f'--- {names.get(ident, ident)}\n{"".join(traceback.format_stack(frame))}')
+        return '\n'.join(stacks)
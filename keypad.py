@@ -0,0 +1,260 @@
+import logging
+import select
+import selectors
+import threading as th
+import time
+
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+from logs import RATE_LIMITED
+from metrics import Metrics
+
+CARD_EVENT = 'CD'
+KBD_EVENT = 'KB'
+
+FRAME_TYPES = {
+    CARD_EVENT.encode(): CARD_EVENT,
+    KBD_EVENT.encode(): KBD_EVENT,
+}
+FRAME_END = b'\n'
+MAX_FRAME = 64  # bytes without frame end, longer frames are line noise
+DEBOUNCE_WINDOW = 2  # seconds, repeated reads of the same card within window are dropped
+DEBOUNCE_SIZE = 16  # cards remembered by debounce
+
+
+class Frame(NamedTuple):
+    """ Single keypad frame as it was received from serial """
+    kind: str  # CARD_EVENT or KBD_EVENT
+    raw: bytes
+    stamp: float  # monotonic time when frame end was received
+
+
+class FrameReader:
+
+    """ Reassembles keypad frames from serial byte stream
+
+        Frame is `<2 bytes prefix><2 bytes type><payload>\\n`, type is CD (card) or KB (keyboard).
+        Counters are kept in metrics as serial.bytes, serial.frames, serial.malformed, serial.dropped
+    """
+
+    def __init__(self, port=None, metrics: Optional[Metrics] = None, capture=None):
+        self.port = port
+        self.metrics = metrics or Metrics()
+        self.capture = capture  # capture.CaptureWriter recording raw serial input
+        self.buffer = bytearray()
+        self._scanned = 0  # buffer offset already checked for frame end
+        self._selectable = self._has_fileno(port)
+
+    def read(self, timeout: float) -> List[Frame]:
+        """ Wait up to `timeout` seconds for serial data, return frames completed by it """
+        if self._selectable:
+            ready, _, _ = select.select([self.port], [], [], timeout)
+            if not ready:
+                return []
+        # without fd readiness blocking read relies on port timeout
+        chunk = self.port.read(self.port.in_waiting or 1)
+        return self.feed(chunk)
+
+    def feed(self, chunk: bytes) -> List[Frame]:
+        """ Append raw bytes to buffer, return completed frames """
+        if not chunk:
+            return []
+        stamp = time.monotonic()
+        if self.capture:
+            self.capture.write(chunk, stamp)
+        self.metrics.incr('serial.bytes', len(chunk))
+        buffer = self.buffer
+        buffer += chunk
+        frames = []
+        start = 0
+        end = buffer.find(FRAME_END, self._scanned)
+        with memoryview(buffer) as view:
+            while end != -1:
+                frame = self._frame(view[start:end + 1], stamp)
+                if frame:
+                    frames.append(frame)
+                start = end + 1
+                end = buffer.find(FRAME_END, start)
+        if start:
+            del buffer[:start]
+        if len(buffer) > MAX_FRAME:
+            # no frame end in sight, drop partial frame
+            self.metrics.incr('serial.dropped')
+            buffer.clear()
+        self._scanned = len(buffer)
+        return frames
+
+    def _frame(self, line: memoryview, stamp: float) -> Optional[Frame]:
+        """ Make frame from buffer slice including frame end, the only copy of frame bytes """
+        kind = FRAME_TYPES.get(line[2:4].tobytes())
+        if not kind or len(line) > MAX_FRAME + 1:
+            if line.tobytes().strip():
+                # empty lines are skipped silently
+                self.metrics.incr('serial.malformed')
+            return
+        self.metrics.incr('serial.frames')
+        return Frame(kind, line.tobytes(), stamp)
+
+    @staticmethod
+    def _has_fileno(port) -> bool:
+        try:
+            port.fileno()
+            return True
+        except Exception:
+            return False
+
+
+class CardDebounce:
+
+    """ Coalesces repeated reads of a card held against the reader
+
+        Card frame is dropped if the same card was read less than `window` seconds before,
+        every dropped read extends the window. Last `size` cards are kept in a ring buffer,
+        cards are keyed by raw frame bytes, so nothing is decoded.
+        Dropped frames are counted in metrics as input.cards_coalesced.
+    """
+
+    def __init__(self, window: float = DEBOUNCE_WINDOW, size: int = DEBOUNCE_SIZE,
+                 metrics: Optional[Metrics] = None):
+        self.window = window
+        self.metrics = metrics or Metrics()
+        self.ring = [None] * size
+        self.position = 0
+        self.seen = {}  # frame raw bytes -> last read monotonic time
+
+    def accept(self, frame: Frame) -> bool:
+        if frame.kind != CARD_EVENT:
+            return True
+        key = frame.raw
+        last = self.seen.get(key)
+        self.seen[key] = frame.stamp
+        if last is not None:
+            if frame.stamp - last < self.window:
+                self.metrics.incr('input.cards_coalesced')
+                return False
+            return True
+        evicted = self.ring[self.position]
+        if evicted is not None:
+            del self.seen[evicted]
+        self.ring[self.position] = key
+        self.position = (self.position + 1) % len(self.ring)
+        return True
+
+
+class SerialMux:
+
+    """ Reads several keypad ports in one I/O thread
+
+        Every port has its own FrameReader, completed frames are passed to port's on_frame callback.
+        Port which failed to read is removed and passed to its on_lost callback with the error.
+    """
+
+    def __init__(self, timeout: float = 1):
+        self.timeout = timeout
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+
+    def register(self, port, on_frame: Callable, metrics: Optional[Metrics] = None, capture=None,
+                 on_lost: Optional[Callable] = None):
+        self.selector.register(port, selectors.EVENT_READ, (FrameReader(port, metrics, capture), on_frame, on_lost))
+
+    def unregister(self, port):
+        self.selector.unregister(port)
+
+    def start(self):
+        if not self.thread:
+            self.thread = th.Thread(target=self._run, name='serial mux Thread', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            if not self.selector.get_map():
+                time.sleep(self.timeout)
+                continue
+            for key, _ in self.selector.select(self.timeout):
+                reader, on_frame, on_lost = key.data
+                try:
+                    chunk = reader.port.read(reader.port.in_waiting or 1)
+                except Exception as e:
+                    self.unregister(reader.port)
+                    if on_lost:
+                        on_lost(reader.port, e)
+                    else:
+                        logging.exception(f'failed to read {reader.port}, port removed', extra=RATE_LIMITED)
+                    continue
+                for frame in reader.feed(chunk):
+                    on_frame(frame)
+
+
+TRIE_END = ''  # key of node where a code ends, never a keypad digit
+TRIE_LIMIT = 10000  # keypad codes, larger ACLs are checked on submit only
+
+
+class CodeTrie:
+
+    """ Prefix tree of keypad codes, only codes made of digits could be typed on keypad """
+
+    __slots__ = ('root', 'size')
+
+    def __init__(self, codes: Iterable[str]):
+        self.root = {}
+        self.size = 0
+        for code in codes:
+            code = str(code)
+            if not code.isdigit():
+                continue
+            node = self.root
+            for digit in code:
+                node = node.setdefault(digit, {})
+            node[TRIE_END] = True
+            self.size += 1
+
+    @classmethod
+    def build(cls, codes) -> Optional['CodeTrie']:
+        """ Trie of codes if they could be enumerated and are not too many """
+        if not isinstance(codes, frozenset):
+            # compiled ACL keeps code hashes only
+            return
+        digit_codes = [code for code in codes if code.isdigit()]
+        if len(digit_codes) > TRIE_LIMIT:
+            logging.warning(f'{len(digit_codes)} keypad codes, early rejection disabled')
+            return
+        return cls(digit_codes)
+
+
+class KeypadEntry:
+
+    """ Code being typed on keypad, every digit moves trie cursor one node down
+
+        Without trie every prefix is considered possible.
+    """
+
+    __slots__ = ('trie', 'digits', 'node')
+
+    def __init__(self, trie: Optional[CodeTrie] = None):
+        self.reset(trie)
+
+    def reset(self, trie: Optional[CodeTrie] = None):
+        self.trie = trie
+        self.digits = []
+        self.node = trie.root if trie else None
+
+    def push(self, digit: str) -> bool:
+        """ Add digit, returns False if no code starts with digits typed """
+        self.digits.append(digit)
+        if self.node is not None:
+            self.node = self.node.get(digit)
+        return self.possible
+
+    @property
+    def code(self) -> str:
+        return ''.join(self.digits)
+
+    @property
+    def possible(self) -> bool:
+        return self.trie is None or self.node is not None
+
+    @property
+    def unambiguous(self) -> bool:
+        """ Typed code is in trie and no other code starts with it """
+        return self.node is not None and len(self.node) == 1 and TRIE_END in self.node
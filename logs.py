@@ -0,0 +1,132 @@
+""" Lock logging: records are formatted and written by background listener thread """
+import atexit
+import logging
+import time
+
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from typing import Callable, List, Optional
+
+LOG_QUEUE_SIZE = 10000  # records waiting for listener, overflow is dropped
+LOG_RATE = 1  # records per second from the same call site after burst
+LOG_BURST = 10  # records from the same call site logged without limit
+RATE_LIMIT_SITES = 1024  # call sites remembered by rate limiter
+RATE_LIMITED = {'rate_limited': True}  # `extra` of INFO and above records from known noise sources
+
+
+class Fields:
+
+    """ Structured log payload, rendered as key=value pairs only when record is emitted """
+
+    __slots__ = ('fields',)
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def __str__(self):
+        return ' '.join(f'{key}={value}' for key, value in self.fields.items() if value is not None)
+
+
+def log_fields(logger: logging.Logger, level: int, event: str, **fields):
+    """ Log structured record, fields are also available to handlers as record.fields """
+    if logger.isEnabledFor(level):
+        logger.log(level, '%s %s', event, Fields(**fields), extra={'fields': fields})
+
+
+class RateLimitFilter(logging.Filter):
+
+    """ Token bucket per call site: `burst` records at once, then `rate` records per second
+
+        Only records below `level` and records logged with extra=RATE_LIMITED are limited,
+        structured records (log_fields) never are, so access decisions are always logged.
+        Call site, not message text, is the key, so floods of f-string messages are limited too.
+        Number of suppressed records is appended to the next record passed from the same call site.
+    """
+
+    def __init__(self,
+                 rate: float = LOG_RATE,
+                 burst: int = LOG_BURST,
+                 clock: Callable = time.monotonic,
+                 level: int = logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.level = level
+        self.sites = {}  # (pathname, lineno) -> [tokens, last update, suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if hasattr(record, 'fields'):
+            return True
+        if record.levelno >= self.level and not getattr(record, 'rate_limited', False):
+            return True
+        now = self.clock()
+        key = (record.pathname, record.lineno)
+        site = self.sites.get(key)
+        if site is None:
+            if len(self.sites) >= RATE_LIMIT_SITES:
+                self.sites.clear()
+            site = self.sites[key] = [self.burst, now, 0]
+        site[0] = min(self.burst, site[0] + (now - site[1]) * self.rate)
+        site[1] = now
+        if site[0] < 1:
+            site[2] += 1
+            return False
+        site[0] -= 1
+        if site[2]:
+            record.msg = f'{record.msg} [{site[2]} similar suppressed]'
+            site[2] = 0
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+
+    """ Queue handler which leaves formatting to listener thread and never blocks """
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class LogListener(QueueListener):
+
+    """ Queue listener which could be stopped more than once """
+
+    def stop(self):
+        if self._thread:
+            super().stop()
+
+
+def setup_async_logging(logger: Optional[logging.Logger] = None,
+                        rate: float = LOG_RATE,
+                        burst: int = LOG_BURST,
+                        maxsize: int = LOG_QUEUE_SIZE) -> List[LogListener]:
+    """ Move handlers of logger and root logger to background listener threads """
+    listeners = []
+    targets = [logging.getLogger()]
+    if logger and logger is not targets[0]:
+        targets.append(logger)
+    for target in targets:
+        handlers = list(target.handlers)
+        if not handlers:
+            continue
+        for handler in handlers:
+            target.removeHandler(handler)
+        queue = Queue(maxsize)
+        queue_handler = DeferredQueueHandler(queue)
+        queue_handler.addFilter(RateLimitFilter(rate, burst))
+        target.addHandler(queue_handler)
+        listener = LogListener(queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        listeners.append(listener)
+    return listeners
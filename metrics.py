@@ -0,0 +1,150 @@
+import threading as th
+import time
+
+from typing import Optional
+
+HISTOGRAM_BUCKETS = 32  # power of two microsecond buckets, last one is up to ~36 minutes
+
+
+class Histogram:
+
+    """ Latency histogram with power of two microsecond buckets, values in seconds """
+
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        # bucket N holds values below 2**N microseconds
+        bucket = int(value * 1000000).bit_length()
+        self.buckets[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """ Upper bound of bucket holding q-th percentile, capped by max value """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) / 1000000, self.max)
+        return self.max
+
+    def as_dict(self) -> dict:
+        mean = self.total / self.count if self.count else None
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': mean,
+            'p50': self.percentile(.5),
+            'p99': self.percentile(.99),
+        }
+
+    def summary(self) -> list:
+        """ Compact [count, p50 ms, p99 ms, max ms] """
+        return [self.count] + [round(value * 1000, 2) if value is not None else None
+                               for value in (self.percentile(.5), self.percentile(.99), self.max)]
+
+
+class Metrics:
+
+    """ In-memory counters, gauges and latency stats shared between lock threads """
+
+    def __init__(self):
+        # reentrant, metrics could be recorded by code interrupting the thread holding the lock
+        self._lock = th.RLock()
+        self.counters = {}
+        self.gauges = {}
+        self.latency = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            stats = self.latency.get(name)
+            if not stats:
+                stats = self.latency[name] = Histogram()
+            stats.add(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'latency': {name: stats.as_dict() for name, stats in self.latency.items()},
+            }
+
+    def summary(self, prefix: str = '') -> dict:
+        """ Compact latency summary {name: [count, p50 ms, p99 ms, max ms]} """
+        with self._lock:
+            return {name[len(prefix):]: stats.summary() for name, stats in self.latency.items()
+                    if name.startswith(prefix)}
+
+
+class Trace:
+
+    """ Hot path trace of a single input, records latency of each stage to `trace.<stage>` histograms
+
+        Stage latency is time since previous stage, `trace.total` is time since input was received.
+    """
+
+    __slots__ = ('metrics', 'started', 'last')
+
+    def __init__(self, metrics: Metrics, started: float):
+        self.metrics = metrics
+        self.started = self.last = started
+
+    def mark(self, stage: str):
+        now = time.monotonic()
+        self.metrics.observe(f'trace.{stage}', now - self.last)
+        self.last = now
+
+    def finish(self, stage: str):
+        self.mark(stage)
+        self.metrics.observe('trace.total', self.last - self.started)
+
+
+class PhaseTimer:
+
+    """ Durations of consecutive startup phases, phases running in parallel are recorded separately """
+
+    def __init__(self):
+        self.started = self.last = time.monotonic()
+        self.phases = []  # [(phase, seconds)]
+
+    def mark(self, phase: str) -> float:
+        """ End phase started by previous mark """
+        now = time.monotonic()
+        elapsed = now - self.last
+        self.last = now
+        self.phases.append((phase, elapsed))
+        return elapsed
+
+    def record(self, phase: str, seconds: float):
+        self.phases.append((phase, seconds))
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def report(self) -> str:
+        phases = ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in self.phases)
+        return f'{phases}; total {self.elapsed():.3f}s'
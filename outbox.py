@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import socket
+import threading as th
+import time
+
+from queue import Queue, Empty, Full
+from typing import Callable, Optional
+
+from metrics import Metrics
+
+OUTBOX_SIZE = 256  # events kept in memory, overflow goes to spool
+OUTBOX_BATCH = 32  # max events sent in one flush
+RETRY_INTERVAL = 5  # seconds between broker checks while events are spooled
+PROBE_TTL = 5  # seconds broker is considered online after successful check
+PROBE_TIMEOUT = 1
+STOP = None  # queue sentinel waking worker on close
+
+
+class BrokerProbe:
+
+    """ Checks MQTT broker reachability with TCP connect, successful result is cached for PROBE_TTL """
+
+    def __init__(self, host: str, port: int = 1883):
+        self.host = host
+        self.port = port
+        self.checked = 0
+        self.online = False
+
+    def __call__(self) -> bool:
+        now = time.monotonic()
+        if self.online and now - self.checked < PROBE_TTL:
+            return True
+        try:
+            with socket.create_connection((self.host, self.port), timeout=PROBE_TIMEOUT):
+                self.online = True
+        except OSError:
+            self.online = False
+        self.checked = now
+        return self.online
+
+
+class EventOutbox:
+
+    """ Outbound events queue flushed in batches by worker thread
+
+        Events which could not be delivered (broker is down, sender failed, queue overflow)
+        are appended to spool file and replayed in order when broker is back.
+        Every event gets `time` (unix time) when it's enqueued, so replayed events keep their time.
+        Worker keeps batch in memory and retries if spool could not be written.
+        Spool lines which could not be parsed (cut short by power loss) are skipped.
+        Metrics: outbox.depth, outbox.spooled gauges, outbox.flush latency, outbox.sent, outbox.replayed,
+        outbox.spilled, outbox.failed, outbox.spool_errors, outbox.corrupt, outbox.errors, outbox.lost counters.
+
+        sender: sends list of events, raises on failure
+        online: broker availability check
+    """
+
+    def __init__(self,
+                 sender: Callable,
+                 spool_path: str,
+                 online: Optional[Callable] = None,
+                 metrics: Optional[Metrics] = None,
+                 maxsize: int = OUTBOX_SIZE):
+        self.sender = sender
+        self.spool_path = spool_path
+        self.online = online or (lambda: True)
+        self.metrics = metrics or Metrics()
+        self.queue = Queue(maxsize)
+        self.spooled = self._count_spooled()
+        self.worker = None
+        self.pending = []  # batch taken by worker, not sent or spooled yet
+        self._spool_lock = th.Lock()
+        self._stopped = th.Event()
+
+    def start(self):
+        if not self.worker:
+            self.worker = th.Thread(target=self._run, name='outbox Thread', daemon=True)
+            self.worker.start()
+
+    def put(self, event: dict):
+        """ Enqueue event, never blocks """
+        if 'time' not in event:
+            event = dict(event, time=round(time.time(), 3))
+        try:
+            self.queue.put_nowait(event)
+        except Full:
+            self.metrics.incr('outbox.spilled')
+            self._spool_or_drop([event])
+        self.metrics.gauge('outbox.depth', self.queue.qsize())
+
+    def close(self, timeout: float = PROBE_TIMEOUT):
+        """ Stop worker, spool events it hasn't sent """
+        self._stopped.set()
+        try:
+            self.queue.put_nowait(STOP)
+        except Full:
+            pass
+        if self.worker:
+            self.worker.join(timeout)
+        self._spool_or_drop(self.pending + self._drain())
+        self.pending = []
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self.pending:
+                self.pending = self._collect(RETRY_INTERVAL if self.spooled else None)
+            try:
+                if self.spooled and self.online():
+                    self._replay()
+                if self.pending:
+                    self._flush(self.pending)
+                self.pending = []
+            except OSError:
+                # disk full or read-only: batch stays in memory, new events wait in queue
+                logging.exception(f'failed to write spool, {len(self.pending)} events kept for retry')
+                self.metrics.incr('outbox.spool_errors')
+                self._stopped.wait(RETRY_INTERVAL)
+            except Exception:
+                logging.exception(f'outbox worker error, {len(self.pending)} events kept for retry')
+                self.metrics.incr('outbox.errors')
+                self._stopped.wait(RETRY_INTERVAL)
+
+    def _collect(self, timeout: Optional[float]) -> list:
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except Empty:
+            return []
+        while len(batch) < OUTBOX_BATCH:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        self.metrics.gauge('outbox.depth', self.queue.qsize())
+        return [event for event in batch if event is not STOP]
+
+    def _flush(self, batch: list):
+        if self.spooled or not self.online():
+            # keep events order, older events are still in spool
+            return self._spool(batch)
+        if self._send(batch):
+            self.metrics.incr('outbox.sent', len(batch))
+        else:
+            self._spool(batch)
+
+    def _send(self, batch: list) -> bool:
+        started = time.monotonic()
+        try:
+            self.sender(batch)
+        except Exception:
+            logging.exception('failed to send events')
+            self.metrics.incr('outbox.failed')
+            return False
+        self.metrics.observe('outbox.flush', time.monotonic() - started)
+        return True
+
+    def _replay(self):
+        # spool is locked for reads and rewrites only, events overflowing queue are spooled while sending
+        with self._spool_lock:
+            events, offset = self._read_spool()
+        sent = 0
+        while sent < len(events):
+            batch = events[sent:sent + OUTBOX_BATCH]
+            if not self._send(batch):
+                # keep what is left for next attempt
+                break
+            sent += len(batch)
+        with self._spool_lock:
+            added, _ = self._read_spool(offset)
+            self._rewrite(events[sent:] + added)
+        if sent:
+            self.metrics.incr('outbox.replayed', sent)
+            logging.info(f'{sent} spooled events replayed')
+
+    def _read_spool(self, offset: int = 0) -> tuple:
+        """ Events spooled after offset and offset of spool end """
+        try:
+            with open(self.spool_path, 'rb') as fh:
+                fh.seek(offset)
+                lines = fh.read().splitlines()
+                offset = fh.tell()
+        except FileNotFoundError:
+            return [], 0
+        events = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                logging.error(f'corrupt spool line skipped: {line[:100]!r}')
+                self.metrics.incr('outbox.corrupt')
+        return events, offset
+
+    def _spool(self, events: list):
+        """ Append events to spool, raises OSError if spool could not be written """
+        if not events:
+            return
+        with self._spool_lock:
+            with open(self.spool_path, 'ab+') as fh:
+                data = ''.join(json.dumps(event) + '\n' for event in events).encode()
+                if fh.tell():
+                    fh.seek(-1, os.SEEK_END)
+                    if fh.read(1) != b'\n':
+                        # line cut short by power loss should not swallow next event
+                        data = b'\n' + data
+                fh.write(data)
+            self.spooled += len(events)
+            self.metrics.gauge('outbox.spooled', self.spooled)
+
+    def _spool_or_drop(self, events: list):
+        """ Spool events outside of worker, there is nothing to keep them in when spool fails """
+        try:
+            self._spool(events)
+        except OSError:
+            logging.exception(f'failed to spool events, {len(events)} events lost')
+            self.metrics.incr('outbox.lost', len(events))
+
+    def _rewrite(self, events: list):
+        tmp_path = f'{self.spool_path}.tmp'
+        with open(tmp_path, 'w') as fh:
+            fh.writelines(json.dumps(event) + '\n' for event in events)
+        os.replace(tmp_path, self.spool_path)
+        self.spooled = len(events)
+        self.metrics.gauge('outbox.spooled', self.spooled)
+
+    def _drain(self) -> list:
+        events = []
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except Empty:
+                return events
+            if event is not STOP:
+                events.append(event)
+
+    def _count_spooled(self) -> int:
+        try:
+            with open(self.spool_path) as fh:
+                return sum(1 for line in fh if line.strip())
+        except FileNotFoundError:
+            return 0
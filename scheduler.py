@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading as th
+import time
+
+from typing import Callable, Optional
+
+
+class ScheduledAction:
+
+    """ Handle of an action scheduled for later execution """
+
+    __slots__ = ('due', 'callback', 'args', 'cancelled', 'name')
+
+    def __init__(self, due: float, callback: Callable, args: tuple, name: Optional[str] = None):
+        self.due = due
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.name = name  # timer name for named timers
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        name = self.name or getattr(self.callback, '__name__', self.callback)
+        return f'<ScheduledAction {name} at {self.due:.3f}>'
+
+
+class Scheduler:
+
+    """ Monotonic-clock action scheduler and timer service, actions are executed by main loop thread
+
+        Named timers are cancellable by name, any number of them could run concurrently.
+
+        wakeup: called when an action scheduled from another thread becomes the nearest one,
+                so the main loop could recalculate its wait timeout
+    """
+
+    def __init__(self, wakeup: Optional[Callable] = None, clock: Callable = time.monotonic):
+        self.clock = clock
+        self.wakeup = wakeup
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = th.Lock()
+        self._loop_thread = None
+        self.timers = {}  # timer name -> ScheduledAction
+
+    def call_at(self, due: float, callback: Callable, *args) -> ScheduledAction:
+        return self._push(ScheduledAction(due, callback, args))
+
+    def _push(self, action: ScheduledAction) -> ScheduledAction:
+        with self._lock:
+            if action.name:
+                previous = self.timers.get(action.name)
+                if previous:
+                    previous.cancel()
+                self.timers[action.name] = action
+            heapq.heappush(self._heap, (action.due, next(self._seq), action))
+            nearest = self._heap[0][2] is action
+        if nearest and self.wakeup and th.get_ident() != self._loop_thread:
+            self.wakeup()
+        return action
+
+    def call_later(self, delay: float, callback: Callable, *args) -> ScheduledAction:
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def set_timer(self, name: str, delay: float, callback: Callable, *args) -> ScheduledAction:
+        """ Start named timer, running timer with the same name is cancelled """
+        return self._push(ScheduledAction(self.clock() + delay, callback, args, name))
+
+    def cancel_timer(self, name: str) -> bool:
+        """ Cancel named timer, returns False if there was no such timer running """
+        with self._lock:
+            action = self.timers.pop(name, None)
+        if action and not action.cancelled:
+            action.cancel()
+            return True
+        return False
+
+    def cancel_timers(self):
+        """ Cancel all named timers, scheduled actions are kept """
+        with self._lock:
+            timers, self.timers = self.timers, {}
+        for action in timers.values():
+            action.cancel()
+
+    def remaining(self, name: str) -> Optional[float]:
+        """ Seconds left until named timer fires, None if there is no such timer running """
+        action = self.timers.get(name)
+        if action and not action.cancelled:
+            return max(0, action.due - self.clock())
+
+    def next_deadline(self) -> Optional[float]:
+        with self._lock:
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            if self._heap:
+                return self._heap[0][0]
+
+    def timeout(self) -> Optional[float]:
+        """ Seconds left until the nearest action, None if nothing scheduled """
+        deadline = self.next_deadline()
+        if deadline is not None:
+            return max(0, deadline - self.clock())
+
+    def run_due(self) -> int:
+        """ Run all actions which are due, returns number of actions executed """
+        self._loop_thread = th.get_ident()
+        executed = 0
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > self.clock():
+                    return executed
+                _, _, action = heapq.heappop(self._heap)
+                if action.name and self.timers.get(action.name) is action:
+                    del self.timers[action.name]
+            if action.cancelled:
+                continue
+            action.cancelled = True  # executed actions could not be cancelled anymore
+            try:
+                action.callback(*action.args)
+            except Exception:
+                logging.exception(f'scheduled action {action} failed')
+            executed += 1
+
+
+class LoopScheduler(Scheduler):
+
+    """ Scheduler which actions are run by asyncio event loop timer instead of main loop polling
+
+        Loop timer is kept armed for the nearest deadline only.
+        after: called from loop after due actions were executed
+    """
+
+    def __init__(self, loop, after: Optional[Callable] = None):
+        super().__init__(clock=loop.time)
+        self.loop = loop
+        self.after = after
+        self._handle = None
+        self._armed = None  # deadline loop timer is armed for
+
+    def _push(self, action: ScheduledAction) -> ScheduledAction:
+        super()._push(action)
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if current is self.loop:
+            self._arm()
+        else:
+            self.loop.call_soon_threadsafe(self._arm)
+        return action
+
+    def _arm(self):
+        deadline = self.next_deadline()
+        if deadline is None or deadline == self._armed:
+            return
+        if self._handle:
+            self._handle.cancel()
+        self._armed = deadline
+        self._handle = self.loop.call_at(deadline, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        self._armed = None
+        if self.run_due() and self.after:
+            self.after()
+        self._arm()
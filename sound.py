@@ -0,0 +1,398 @@
+import heapq
+import itertools
+import logging
+import os
+import threading as th
+import time
+
+from collections import OrderedDict, deque
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from metrics import Metrics
+
+SOUND_EXTENSIONS = ('.ogg', '.wav')
+SOUND_CACHE_MB = 32  # decoded sounds memory budget
+SOUND_WATCH_INTERVAL = 5  # seconds between sound_dir checks for changed files
+CHANNELS = ('bg', 'fg')
+LOOP_CHECK_INTERVAL = .5  # seconds between looping channels checks when mixer end events are not available
+
+# audio cue actions
+CUE_PLAY = 'play'
+CUE_LOOP = 'loop'  # play sound endlessly until channel is stopped, faded out or played something else
+CUE_FADE = 'fade'
+CUE_STOP = 'stop'
+
+pg = None  # pygame import takes seconds on device boot, it's imported on first use
+
+
+def _pygame():
+    global pg
+    if pg is None:
+        import pygame
+        pg = pygame
+    return pg
+
+
+class Clip:
+
+    """ Decoded sound with its memory footprint """
+
+    __slots__ = ('sound', 'size', 'mtime')
+
+    def __init__(self, sound, size: int, mtime: float):
+        self.sound = sound
+        self.size = size
+        self.mtime = mtime
+
+
+class SoundBank:
+
+    """ Decoded, mixer-ready sound clips with memory budget and LRU eviction
+
+        Clips are named after files in sound_dir without extension.
+        Stats are kept in metrics as sound.hits, sound.misses, sound.evictions, sound.decode latency
+        and sound.cache_bytes gauge.
+    """
+
+    def __init__(self, sound_dir: str, max_bytes: int = SOUND_CACHE_MB * 1024 * 1024,
+                 metrics: Optional[Metrics] = None):
+        _pygame()
+        self.sound_dir = sound_dir
+        self.max_bytes = max_bytes
+        self.metrics = metrics or Metrics()
+        self.clips = OrderedDict()  # least recently used first
+        self.index = None  # {name: path} of sound_dir as of last scan
+        self.size = 0
+        self._lock = th.RLock()
+        self._watcher = None
+
+    def files(self) -> dict:
+        """ Scan sound_dir for sound files, returns index as {name: path} """
+        result = {}
+        for entry in os.scandir(self.sound_dir):
+            name, ext = os.path.splitext(entry.name)
+            if ext.lower() in SOUND_EXTENSIONS and entry.is_file():
+                result[name] = entry.path
+        self.index = result
+        return result
+
+    def get(self, name: str):
+        with self._lock:
+            clip = self.clips.get(name)
+            if clip:
+                self.clips.move_to_end(name)
+                self.metrics.incr('sound.hits')
+                return clip.sound
+        self.metrics.incr('sound.misses')
+        return self.load(name).sound
+
+    def load(self, name: str) -> Clip:
+        """ Decode clip from sound_dir and put it to cache """
+        clip = self._decode(name)
+        with self._lock:
+            self._insert(name, clip)
+        return clip
+
+    def preload(self, names: Optional[Iterable[str]] = None):
+        """ Decode clips in given order, then all the rest from sound_dir, as long as budget allows """
+        available = self.files()
+        ordered = [name for name in (names or []) if name in available]
+        ordered += sorted(set(available) - set(ordered))
+        for name in ordered:
+            if name in self.clips:
+                continue
+            try:
+                clip = self._decode(name)
+            except Exception:
+                logging.exception(f'failed to preload sound {name}')
+                continue
+            with self._lock:
+                if self.size + clip.size > self.max_bytes:
+                    # preloading should not evict clips loaded before, smaller clips may still fit
+                    continue
+                self._insert(name, clip)
+
+    def preload_async(self, names: Optional[Iterable[str]] = None) -> th.Thread:
+        thread = th.Thread(target=self.preload, args=(names,), name='sound preload Thread', daemon=True)
+        thread.start()
+        return thread
+
+    def reload_changed(self) -> list:
+        """ Decode again cached clips which files were changed, drop clips which files were removed,
+            decode files added since last scan as long as budget allows
+        """
+        changed = []
+        known = self.index or {}
+        available = self.files()
+        with self._lock:
+            cached = list(self.clips.items())
+        added = sorted(set(available) - set(known) - set(name for name, _ in cached))
+        for name, clip in cached:
+            path = available.get(name)
+            try:
+                mtime = os.stat(path).st_mtime if path else None
+            except FileNotFoundError:
+                mtime = None
+            if mtime is None:
+                with self._lock:
+                    if self.clips.get(name) is clip:
+                        del self.clips[name]
+                        self.size -= clip.size
+                changed.append(name)
+            elif mtime != clip.mtime:
+                self.load(name)
+                changed.append(name)
+        for name in added:
+            try:
+                clip = self._decode(name)
+            except Exception:
+                logging.exception(f'failed to load new sound {name}')
+                continue
+            with self._lock:
+                if self.size + clip.size > self.max_bytes:
+                    break
+                self._insert(name, clip)
+            changed.append(name)
+        return changed
+
+    def watch(self, interval: float = SOUND_WATCH_INTERVAL) -> th.Thread:
+        """ Start watching sound_dir for changed files """
+        if not self._watcher:
+            self._watcher = th.Thread(target=self._watch, args=(interval,), name='sound watch Thread', daemon=True)
+            self._watcher.start()
+        return self._watcher
+
+    def _watch(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                changed = self.reload_changed()
+                if changed:
+                    logging.info(f'sounds reloaded: {changed}')
+            except Exception:
+                logging.exception('sound reload failed')
+
+    def _decode(self, name: str) -> Clip:
+        index = self.index if self.index is not None else self.files()
+        path = index.get(name)
+        if not path:
+            raise KeyError(f'no sound {name} in {self.sound_dir}')
+        mtime = os.stat(path).st_mtime
+        started = time.monotonic()
+        sound = pg.mixer.Sound(file=path)
+        self.metrics.observe('sound.decode', time.monotonic() - started)
+        return Clip(sound, self._sound_size(sound), mtime)
+
+    def _insert(self, name: str, clip: Clip):
+        previous = self.clips.pop(name, None)
+        if previous:
+            self.size -= previous.size
+        self.clips[name] = clip
+        self.size += clip.size
+        self._evict()
+
+    def _evict(self):
+        # newest clip is never evicted even if it doesn't fit budget alone
+        while self.size > self.max_bytes and len(self.clips) > 1:
+            _, clip = self.clips.popitem(last=False)
+            self.size -= clip.size
+            self.metrics.incr('sound.evictions')
+        self.metrics.gauge('sound.cache_bytes', self.size)
+
+    @staticmethod
+    def _sound_size(sound) -> int:
+        frequency, sample_format, channels = pg.mixer.get_init()
+        return int(sound.get_length() * frequency * channels * (abs(sample_format) // 8))
+
+
+class Cue(NamedTuple):
+    action: str
+    channel: str
+    sound: Optional[str] = None
+    fade_ms: int = 0  # fade in for play and loop, fade out for fade
+    loops: int = 0  # repeats of played sound
+
+
+class AudioScheduler:
+
+    """ Audio thread owning mixer channels, cues from other threads are run at their due time
+
+        Cues are passed through deque, which needs no lock, and wake audio thread up.
+        Looping channel is played again if it ends without a cue stopping it, end is detected
+        with mixer channel end events (pygame 2) or by checking channels every LOOP_CHECK_INTERVAL.
+        Metrics: sound.cue_lag histogram of seconds cue was run after its due time, sound.loop_restarts.
+    """
+
+    def __init__(self,
+                 bank: SoundBank,
+                 channels: dict,
+                 enabled: Callable = lambda: True,
+                 metrics: Optional[Metrics] = None,
+                 end_events: bool = True,
+                 clock: Callable = time.monotonic):
+        self.bank = bank
+        self.channels = channels
+        self.enabled = enabled
+        self.metrics = metrics or Metrics()
+        self.end_events = end_events
+        self.clock = clock
+        self.incoming = deque()  # (due, cue) from any thread
+        self.pending = []  # heap of (due, seq, cue), audio thread only
+        self.looping = {}  # channel -> (sound, fade_ms) played endlessly
+        self.thread = None
+        self.closed = False
+        self._seq = itertools.count()
+        self._wake = th.Event()
+        self._wake_event = None  # pygame event type waking audio thread in end events mode
+        self._end_types = {}  # pygame event type -> channel
+
+    def cue(self, cue: Cue, delay: Optional[float] = None):
+        """ Queue cue to be run `delay` seconds from now, never blocks """
+        self.incoming.append((self.clock() + (delay or 0), cue))
+        self.wake()
+
+    def wake(self):
+        if self._wake_event is not None:
+            pg.event.post(pg.event.Event(self._wake_event))
+        else:
+            self._wake.set()
+
+    def start(self):
+        if not self.thread:
+            self.thread = th.Thread(target=self._run, name='audio Thread', daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.closed = True
+        self.wake()
+
+    def run_due(self, now: Optional[float] = None) -> Optional[float]:
+        """ Run cues which are due, returns seconds until the next one, None if nothing is pending """
+        now = self.clock() if now is None else now
+        while self.incoming:
+            due, cue = self.incoming.popleft()
+            heapq.heappush(self.pending, (due, next(self._seq), cue))
+        while self.pending and self.pending[0][0] <= now:
+            due, _, cue = heapq.heappop(self.pending)
+            self.metrics.observe('sound.cue_lag', now - due)
+            try:
+                self._run_cue(cue)
+            except Exception:
+                logging.exception(f'audio cue {cue} failed')
+        if self.pending:
+            return max(0, self.pending[0][0] - now)
+
+    def check_loops(self):
+        """ Play again looping channels which are not busy """
+        for channel in list(self.looping):
+            self.on_end(channel)
+
+    def on_end(self, channel: str):
+        """ Channel has finished playing """
+        loop = self.looping.get(channel)
+        # end event of sound replaced by the new one comes when channel is already busy
+        if loop and self.enabled() and not self.channels[channel].get_busy():
+            self.metrics.incr('sound.loop_restarts')
+            self.channels[channel].play(self.bank.get(loop[0]), loops=-1, fade_ms=loop[1])
+
+    def _run_cue(self, cue: Cue):
+        channel = self.channels[cue.channel]
+        if cue.action == CUE_LOOP:
+            if self.looping.get(cue.channel, (None,))[0] == cue.sound and channel.get_busy():
+                # already looping, not interrupted
+                return
+            self.looping.pop(cue.channel, None)
+            if self.enabled():
+                self.looping[cue.channel] = (cue.sound, cue.fade_ms)
+                channel.play(self.bank.get(cue.sound), loops=-1, fade_ms=cue.fade_ms)
+            return
+        # any other cue on channel ends its loop, so channel end is not a loop end
+        self.looping.pop(cue.channel, None)
+        if cue.action == CUE_PLAY:
+            if self.enabled():
+                channel.play(self.bank.get(cue.sound), loops=cue.loops, fade_ms=cue.fade_ms)
+        elif cue.action == CUE_FADE:
+            channel.fadeout(cue.fade_ms)
+        elif cue.action == CUE_STOP:
+            channel.stop()
+
+    def _setup_end_events(self) -> bool:
+        """ Route channel end events to audio thread, pygame event queue needs display subsystem """
+        try:
+            if pg.version.vernum[0] < 2:
+                # event wait with timeout is pygame 2 only
+                return False
+            if not pg.display.get_init():
+                os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+                pg.display.init()
+            for idx, name in enumerate(CHANNELS):
+                event_type = pg.USEREVENT + 1 + idx
+                self.channels[name].set_endevent(event_type)
+                self._end_types[event_type] = name
+            pg.event.set_blocked(None)
+            pg.event.set_allowed([pg.USEREVENT] + list(self._end_types))
+        except Exception as e:
+            logging.warning(f'mixer end events not available ({e}), loops are checked every {LOOP_CHECK_INTERVAL}s')
+            self._end_types = {}
+            return False
+        self._wake_event = pg.USEREVENT
+        # cues queued before switch to event wakeups
+        self._wake.set()
+        return True
+
+    def _run(self):
+        events = self.end_events and self._setup_end_events()
+        while not self.closed:
+            timeout = self.run_due()
+            if events:
+                if self._wake.is_set():
+                    self._wake.clear()
+                    continue
+                wait_ms = -1 if timeout is None else max(1, int(timeout * 1000))
+                received = [pg.event.wait(wait_ms)] + pg.event.get()
+                for event in received:
+                    channel = self._end_types.get(event.type)
+                    if channel:
+                        self.on_end(channel)
+                continue
+            if self.looping:
+                timeout = LOOP_CHECK_INTERVAL if timeout is None else min(timeout, LOOP_CHECK_INTERVAL)
+            self._wake.wait(timeout)
+            self._wake.clear()
+            self.check_loops()
+
+
+class SoundPlayer:
+
+    """ Plays sounds from SoundBank on mixer channels, interface of skabenclient SoundLoader
+
+        Calls never wait: they are cues for audio thread, which owns the channels.
+    """
+
+    def __init__(self, sound_dir: str, max_bytes: int = SOUND_CACHE_MB * 1024 * 1024,
+                 metrics: Optional[Metrics] = None):
+        if not _pygame().mixer.get_init():
+            pg.mixer.init()
+        self.bank = SoundBank(sound_dir, max_bytes, metrics)
+        self.channels = {name: pg.mixer.Channel(idx) for idx, name in enumerate(CHANNELS)}
+        self.enabled = True
+        self.audio = AudioScheduler(self.bank, self.channels, lambda: self.enabled, self.bank.metrics)
+        self.audio.start()
+
+    def play(self, sound: str, channel: str, delay: Optional[float] = None, loops: int = 0, fade_ms: int = 0):
+        if not self.enabled:
+            return
+        if loops < 0:
+            return self.loop(sound, channel, delay, fade_ms)
+        self.audio.cue(Cue(CUE_PLAY, channel, sound, fade_ms, loops), delay)
+
+    def loop(self, sound: str, channel: str, delay: Optional[float] = None, fade_ms: int = 0):
+        """ Play sound endlessly, does nothing if channel is already looping it """
+        if self.enabled:
+            self.audio.cue(Cue(CUE_LOOP, channel, sound, fade_ms), delay)
+
+    def fadeout(self, fadeout_ms: int, channel: str, delay: Optional[float] = None):
+        self.audio.cue(Cue(CUE_FADE, channel, fade_ms=fadeout_ms), delay)
+
+    def stop(self, channel: str, delay: Optional[float] = None):
+        self.audio.cue(Cue(CUE_STOP, channel), delay)
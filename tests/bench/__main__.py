@@ -0,0 +1,251 @@
+""" Hot path benchmarks without hardware
+
+    python -m tests.bench [--quick] [-o results.json]
+    python -m tests.bench --replay capture.bin [--realtime]
+
+    Results are printed (or saved) as JSON, so runs could be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading as th
+import time
+
+import yaml
+
+from .fakes import PtySerial, install_fakes
+
+ACL_SIZES = (10, 100, 1000, 10000, 100000)
+KEYPAD_FRAMES = [b'\x02\x00KB%d\r\n' % digit for digit in range(10)] + [b'\x02\x00KB10\r\n']
+
+
+def _iface() -> str:
+    stream = os.popen("ip route | grep 'default' | sed -nr 's/.*dev ([^\\ ]+).*/\\1/p'")
+    return stream.read().strip() or 'lo'
+
+
+def _percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_us': samples[len(samples) // 2] * 1000000,
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * .99))] * 1000000,
+        'max_us': samples[-1] * 1000000,
+    }
+
+
+def make_device(workdir: str, comport: str = '/dev/null'):
+    from skabenclient.config import SystemConfig
+    from config import LockConfig
+    from device import LockDevice
+
+    sound_dir = os.path.join(workdir, 'sound')
+    os.makedirs(sound_dir, exist_ok=True)
+    system = {
+        'dev_type': 'lock',
+        'name': 'bench',
+        'topic': 'lock',
+        'broker_ip': '127.0.0.1',
+        'iface': _iface(),
+        'comport': comport,
+        'sound_dir': sound_dir,
+        'pin': 11,
+        'gpio': 'fake',
+        'alert': 0,
+        'metrics_interval': 0,
+        'outbox_spool': os.path.join(workdir, 'outbox.spool'),
+    }
+    device = {'closed': True, 'sound': False, 'blocked': False, 'alert': 0, 'acl': {}}
+    paths = []
+    for name, data in (('system.yml', system), ('device.yml', device)):
+        path = os.path.join(workdir, name)
+        with open(path, 'w') as fh:
+            yaml.dump(data, fh)
+        paths.append(path)
+    return LockDevice(SystemConfig(paths[0]), LockConfig(paths[1]))
+
+
+def _drain(queue):
+    while not queue.empty():
+        queue.get_nowait()
+
+
+def bench_parse_data(device, frames: int) -> dict:
+    """ Keypad frames/s through FrameReader and parse_data """
+    from keypad import FrameReader
+
+    reader = FrameReader(metrics=device.metrics)
+    chunk = b''.join(KEYPAD_FRAMES[idx % len(KEYPAD_FRAMES)] for idx in range(frames))
+    started = time.perf_counter()
+    for frame in reader.feed(chunk):
+        device.parse_data(frame.raw)
+    elapsed = time.perf_counter() - started
+    return {'frames': frames, 'seconds': elapsed, 'frames_per_sec': frames / elapsed}
+
+
+def bench_serial_pty(device, frames: int) -> dict:
+    """ Keypad frames/s from pty serial port through FrameReader and parse_data """
+    import serial
+    from keypad import FrameReader
+
+    pty = PtySerial()
+    port = serial.Serial(pty.path, timeout=1)
+    reader = FrameReader(port, device.metrics)
+    done = th.Event()
+    received = []
+
+    def _consume():
+        while len(received) < frames:
+            for frame in reader.read(1):
+                device.parse_data(frame.raw)
+                received.append(frame)
+        done.set()
+
+    consumer = th.Thread(target=_consume, daemon=True)
+    consumer.start()
+    data = b''.join(KEYPAD_FRAMES[idx % len(KEYPAD_FRAMES)] for idx in range(frames))
+    started = time.perf_counter()
+    pty.write(data)
+    done.wait(60)
+    elapsed = time.perf_counter() - started
+    port.close()
+    pty.close()
+    return {'frames': len(received), 'seconds': elapsed, 'frames_per_sec': len(received) / elapsed}
+
+
+def bench_acl(device, sizes: tuple, calls: int, rebuilds: int) -> dict:
+    """ ACL rebuild cost and check_access decision latency by ACL size """
+    config = device.config
+    results = {}
+    for size in sizes:
+        acl = {f'{code:010d}': [code % 5] for code in range(size)}
+        config.update({'acl': acl, 'alert': 0, 'closed': True, 'blocked': False})
+        device.closed = True
+
+        rebuild = []
+        for _ in range(rebuilds):
+            started = time.perf_counter()
+            config.gen_access_list()
+            rebuild.append(time.perf_counter() - started)
+
+        granted = [f'{code:010d}' for code in range(0, size, 5)][:calls]
+        lookup = []
+        for code in granted:
+            started = time.perf_counter()
+            code in config.access_list
+            lookup.append(time.perf_counter() - started)
+
+        denied = []
+        for idx in range(calls):
+            started = time.perf_counter()
+            device.check_access(f'X{idx:09d}')
+            denied.append(time.perf_counter() - started)
+            device.scheduler.cancel_timers()
+            # outbox worker is not running, full queue would measure spool writes
+            _drain(device.outbox.queue)
+        _drain(device.q_int)
+        _drain(device.event_queue)
+
+        results[size] = {
+            'rebuild_ms': statistics.median(rebuild) * 1000,
+            'lookup': _percentiles(lookup),
+            'check_access_denied': _percentiles(denied),
+        }
+    return results
+
+
+def bench_replay(device, path: str, realtime: bool) -> dict:
+    """ Recorded keypad traffic through FrameReader and parse_data """
+    from capture import replay
+
+    def _parse(raw: bytes):
+        device.parse_data(raw)
+        # lock should decide on every frame as if it was idle
+        device.scheduler.run_due()
+        device.scheduler.cancel_timers()
+        _drain(device.q_int)
+        _drain(device.outbox.queue)
+
+    return replay(path, _parse, realtime=realtime, metrics=device.metrics)
+
+
+def bench_idle(workdir: str, seconds: float) -> dict:
+    """ CPU time and main loop wakeups of running idle lock """
+    pty = PtySerial()
+    device = make_device(workdir, comport=pty.path)
+    runner = th.Thread(target=device.run, daemon=True)
+    runner.start()
+    while not device.running:
+        time.sleep(.1)
+    time.sleep(1)  # let startup settle
+
+    wakeups = device.metrics.snapshot()['counters'].get('loop.wakeups', 0)
+    cpu = time.process_time()
+    time.sleep(seconds)
+    cpu = time.process_time() - cpu
+    wakeups = device.metrics.snapshot()['counters'].get('loop.wakeups', 0) - wakeups
+
+    device.running = False
+    device._wakeup()
+    runner.join(5)
+    pty.close()
+    return {'seconds': seconds, 'cpu_percent': cpu / seconds * 100, 'wakeups_per_sec': wakeups / seconds}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tests.bench', description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='save results to JSON file instead of printing')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations and smaller ACL sizes')
+    parser.add_argument('--verbose', action='store_true', help='keep device logging enabled')
+    parser.add_argument('--replay', metavar='CAPTURE', help='replay serial capture instead of benchmarks')
+    parser.add_argument('--realtime', action='store_true', help='replay capture with original timing')
+    args = parser.parse_args(argv)
+
+    install_fakes()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    frames = 2000 if args.quick else 20000
+    calls = 200 if args.quick else 2000
+    sizes = ACL_SIZES[:3] if args.quick else ACL_SIZES
+    with tempfile.TemporaryDirectory() as workdir:
+        device = make_device(workdir)
+        device.closed = True
+        results = {
+            'meta': {
+                'timestamp': time.time(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'quick': args.quick,
+            },
+        }
+        if args.replay:
+            results['replay'] = bench_replay(device, args.replay, args.realtime)
+        else:
+            results.update({
+                'parse_data': bench_parse_data(device, frames),
+                'serial_pty': bench_serial_pty(device, frames),
+                'acl': bench_acl(device, sizes, calls, rebuilds=3 if args.quick else 10),
+                'idle': bench_idle(workdir, seconds=2 if args.quick else 10),
+            })
+        counters = device.metrics.snapshot()['counters']
+        results['gpio'] = {
+            'relay_toggles': device.gpio.toggles(device.pin),
+            'skipped_writes': counters.get('gpio.skipped', 0),
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
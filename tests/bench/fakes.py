@@ -0,0 +1,86 @@
+""" Hardware fakes for running LockDevice without a board: pygame mixer, pty serial port
+
+    GPIO is faked by gpio.FakeGpio backend selected in system config.
+"""
+import os
+import pty
+import sys
+import tty
+import types
+
+
+class FakeSound:
+
+    def __init__(self, file=None, **kwargs):
+        self.file = file
+
+    def get_length(self):
+        return 1.0
+
+
+class FakeChannel:
+
+    def __init__(self, idx):
+        self.idx = idx
+        self.sound = None
+
+    def play(self, sound, loops=0, maxtime=0, fade_ms=0):
+        self.sound = sound
+
+    def stop(self):
+        self.sound = None
+
+    def fadeout(self, ms):
+        self.sound = None
+
+    def get_busy(self):
+        return bool(self.sound)
+
+
+class FakeMixer(types.ModuleType):
+
+    """ pygame.mixer replacement, nothing is decoded or played """
+
+    Sound = FakeSound
+    Channel = FakeChannel
+
+    def __init__(self):
+        super().__init__('pygame.mixer')
+        self._init = None
+
+    def pre_init(self, *args, **kwargs):
+        pass
+
+    def init(self, *args, **kwargs):
+        self._init = (22050, -16, 2)
+
+    def get_init(self):
+        return self._init
+
+
+def install_fakes():
+    """ Replace hardware modules before device is imported """
+    pygame = types.ModuleType('pygame')
+    pygame.mixer = FakeMixer()
+    sys.modules['pygame'] = pygame
+    sys.modules['pygame.mixer'] = pygame.mixer
+
+
+class PtySerial:
+
+    """ Pseudo-terminal pair, keypad bytes written to master are read from slave as from serial port """
+
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.master, view)
+            view = view[written:]
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
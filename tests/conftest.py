@@ -1,7 +1,6 @@
 import os
 import yaml
 import pytest
-import wiringpi as wpi
 
 from ..device import LockDevice
 from ..config import LockConfig
@@ -48,7 +47,8 @@ def default_config():
         "test": "test",
         "name": "main",
         "broker_ip": "127.0.0.1",
-        "iface": _iface()
+        "iface": _iface(),
+        "gpio": "fake",
     }
 
     _dev = {'bool': True,
@@ -131,10 +131,7 @@ def get_device(request, monkeypatch, get_config, default_config):
 
         syscfg = get_config(SystemConfig, default_config('sys'), 'system_config.yml')
 
-        # patch all GPIO operations by default
-        monkeypatch.setattr(wpi, "wiringPiSetup", lambda x: True)
-        monkeypatch.setattr(wpi, "pinMode", lambda *args: True)
-        monkeypatch.setattr(wpi, "digitalWrite", lambda *args: True)
+        # GPIO is in-memory fake backend, see "gpio" in system config
         # patch lock_device
         monkeypatch.setattr(LockDevice, "_serial_read", lambda *args: True)
         # disable GPIO
@@ -152,13 +149,14 @@ def get_device(request, monkeypatch, get_config, default_config):
 
 
 @pytest.fixture
-def get_port_data():
+def get_port_data(tmp_path):
+    """ writes raw serial data to file, returns it split to lines as read from port """
 
-
-    def _dec(data):
-        filepath = os.path.join('tests', 'res', 'portdata')
-        with open(filepath, 'rw') as fh:
+    def _dec(data: bytes):
+        filepath = str(tmp_path / 'portdata')
+        with open(filepath, 'wb+') as fh:
             fh.write(data)
+            fh.seek(0)
             return [r for r in fh]
 
     return _dec
@@ -7,7 +7,7 @@ from skabenclient.config import DeviceConfig, SystemConfig
 from skabenclient.main import start_app
 
 from ..config import LockConfig
-from ..device import LockDevice, wpi
+from ..device import LockDevice
 
 
 @pytest.mark.skip(reason="hanging process of unknown source")
@@ -1 +1,102 @@
-# should be merged later
\ No newline at end of file
+from ..device import CONFIG_EVENT, ENTRY_TIMER, SERIAL_EVENT
+from ..keypad import FrameReader
+
+
+def test_config_change_wakes_main_loop(get_device):
+    device, devcfg, _ = get_device()
+    while not device.event_queue.empty():
+        device.event_queue.get()
+
+    devcfg.update({'closed': False})
+
+    kind, payload, stamp = device.event_queue.get_nowait()
+    assert kind == CONFIG_EVENT, "config change not delivered to main loop"
+    assert stamp > 0
+
+
+def test_report_timer_survives_door_cycle(get_device):
+    device, devcfg, _ = get_device()
+    devcfg.update({'closed': True, 'blocked': False})
+    device.metrics_interval = 60
+    device._schedule_report()
+    device.closed = True
+
+    device.set_opened(timer=True)
+    device.scheduler.run_due()
+    device.set_closed()
+
+    assert device.scheduler.remaining('metrics'), "latency reports should not stop after door cycle"
+
+
+def test_keypad_entry(get_device):
+    device, devcfg, _ = get_device()
+    devcfg.update({'closed': True, 'blocked': False, 'alert': 0, 'acl': {'1234': [0], '5678': [0]}})
+    device.closed = True
+    assert not device.entry_reject, "early rejection should be opt-in"
+    device.entry_autosubmit = True
+    device.entry_reject = True
+
+    device.parse_data(b'\x02\x00KB1\r\n')
+    device.parse_data(b'\x02\x00KB2\r\n')
+    assert device.result == '12'
+    assert device.scheduler.remaining(ENTRY_TIMER), "stale entry should be cleaned by timer"
+
+    device.parse_data(b'\x02\x00KB3\r\n')
+    device.parse_data(b'\x02\x00KB4\r\n')
+    assert device.opening, "unambiguous code should be submitted without #"
+
+    device.opening.cancel()
+    device.opening = None
+    device._release_input(True)
+    devcfg.update({'closed': True})
+    device.parse_data(b'\x02\x00KB9\r\n')
+    assert device.input_hold, "unknown prefix should be rejected at once"
+    assert device.outbox.queue.get_nowait()['success'] is True
+    assert device.outbox.queue.empty(), "partial code should not be reported as access attempt"
+    assert device.metrics.counters['input.entries_rejected'] == 1
+
+
+def test_card_deferred_during_hold_is_checked(get_device):
+    device, devcfg, _ = get_device()
+    devcfg.update({'closed': True, 'blocked': False, 'alert': 0, 'acl': {'GOOD': [0]}})
+    device.closed = True
+    checked = []
+    check_access = device.check_access
+    device.check_access = lambda code: checked.append(code) or check_access(code)
+
+    reader = FrameReader()
+    for raw in (b'\x02\x00CDBAD\r\n', b'\x02\x00CDGOOD\r\n'):
+        frame, = reader.feed(raw)
+        device.handle_event((SERIAL_EVENT, frame, frame.stamp))
+    assert checked == ['BAD'], "card read during denied feedback should be deferred"
+
+    device.input_hold.cancel()
+    device._release_input(True)
+
+    assert checked == ['BAD', 'GOOD']
+    assert not device.metrics.counters.get('input.cards_coalesced')
+
+
+def test_metrics_dump_is_deferred_to_main_loop(get_device):
+    device, _, _ = get_device()
+
+    with device.metrics._lock:
+        # signal arriving while main thread records metrics
+        device._request_dump(10, None)
+    assert device.dump_requested
+
+    device._dump_metrics()
+    assert not device.dump_requested
+
+
+def test_code_trie_rebuilt_by_main_loop(get_device):
+    device, devcfg, _ = get_device()
+    devcfg.update({'closed': True, 'alert': 0, 'acl': {'1234': [0]}})
+    trie = device.entry_trie
+
+    devcfg.update({'acl': {'5678': [0]}})
+    assert device.entry_trie is trie, "config listener should not touch keypad state"
+
+    while not device.event_queue.empty():
+        device.handle_event(device.event_queue.get_nowait())
+    assert device.entry_trie[0] == {'5678'}
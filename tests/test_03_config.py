@@ -1,3 +1,8 @@
+import pytest
+
+from ..config import LockConfig
+
+
 def test_empty_config(get_config, default_config):
     config_dict = default_config("initial")
     config = get_config(config_dict)
@@ -7,4 +12,100 @@ def test_empty_config(get_config, default_config):
 def test_existent_config(get_config, default_config):
     config_dict = default_config("default")
     config = get_config(config_dict)
-    assert config.data == config_dict, "config data not loaded"
\ No newline at end of file
+    assert config.data == config_dict, "config data not loaded"
+
+
+def test_config_snapshot(get_config):
+    config = get_config(LockConfig, {'closed': True, 'blocked': False, 'sound': True, 'acl': {}})
+    snapshot = config.snapshot
+
+    config.update({'closed': False})
+
+    assert snapshot.closed is True, "published snapshot should never change"
+    assert config.snapshot.closed is False
+    assert config.snapshot.version > snapshot.version
+    with pytest.raises(AttributeError):
+        config.snapshot.closed = True
+
+
+def test_write_behind(tmp_path):
+    path = str(tmp_path / 'device.yml')
+    config = LockConfig(path, flush_delay=60)
+    config.save({'closed': True, 'acl': {'111': [0]}})
+    index = config.acl_index
+
+    config.save({'closed': False})
+    config.save({'closed': True})
+    config.save({'closed': False})
+
+    assert config.snapshot.closed is False, "changes should be applied in memory at once"
+    assert config.acl_index is index, "ACL should not be rebuilt when acl is not changed"
+    assert config.dirty
+
+    config.flush(sync=True)
+
+    assert not config.dirty
+    assert LockConfig(path).get('closed') is False
+
+
+def test_acl_delta(tmp_path):
+    path = str(tmp_path / 'device.yml')
+    config = LockConfig(path)
+    config.save({'alert': '1', 'acl': {'111': [1], '222': [1]}, 'acl_version': 5})
+
+    config.save({'acl_delta': {'version': 6, 'add': {'333': [1], '222': [2]}, 'remove': ['111']}})
+
+    assert config.snapshot.access_list == {'333'}
+    assert config.get('acl_version') == 6
+    assert 'acl_delta' not in config.data
+    assert LockConfig(path).access_list == {'333'}, "delta should be persisted"
+
+    config.save({'acl_delta': {'version': 6, 'add': {'444': [1]}}})
+    assert '444' not in config.access_list, "already applied delta should be skipped"
+    assert not config.resync_needed
+
+
+def test_acl_delta_gap(tmp_path):
+    config = LockConfig(str(tmp_path / 'device.yml'))
+    config.save({'alert': '1', 'acl': {'111': [1]}, 'acl_version': 5})
+
+    config.save({'acl_delta': {'version': 8, 'add': {'333': [1]}}})
+
+    assert config.resync_needed
+    assert config.access_list == {'111'}
+    assert config.get('acl_version') == 5
+
+
+def test_acl_delta_on_unversioned_acl(tmp_path):
+    config = LockConfig(str(tmp_path / 'device.yml'))
+    config.save({'alert': '1', 'acl': {'111': [1]}})
+
+    config.save({'acl_delta': {'version': 3, 'add': {'222': [1]}}})
+
+    assert not config.resync_needed
+    assert config.access_list == {'111', '222'}
+    assert config.get('acl_version') == 3
+
+    config.save({'acl': {'333': [1]}})
+    config.save({'acl_delta': {'version': 10, 'add': {'444': [1]}}})
+    assert not config.resync_needed, "full ACL without version should reset baseline"
+    assert config.access_list == {'333', '444'}
+
+
+def test_acl_delta_copies_acl_once(tmp_path):
+    acl = {'111': [1]}
+    config = LockConfig(str(tmp_path / 'device.yml'), flush_delay=60)
+    config.save({'alert': '1', 'acl': acl, 'acl_version': 1})
+
+    config.save({'acl_delta': {'version': 2, 'add': {'222': [1]}}})
+    owned = config.data['acl']
+    config.save({'acl_delta': {'version': 3, 'add': {'333': [1]}}})
+
+    assert acl == {'111': [1]}, "mapping received from server should not change"
+    assert config.data['acl'] is owned, "delta should change config own mapping in place"
+
+    config.flush()
+    config.save({'acl_delta': {'version': 4, 'remove': ['111']}})
+
+    assert owned == {'111': [1], '222': [1], '333': [1]}, "mapping handed to writer should not change"
+    assert config.access_list == {'222', '333'}
@@ -0,0 +1,89 @@
+from ..scheduler import Scheduler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_actions_run_in_deadline_order():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock)
+    result = []
+    scheduler.call_later(1.5, result.append, 'second')
+    scheduler.call_later(0.5, result.append, 'first')
+
+    assert scheduler.run_due() == 0
+    assert scheduler.timeout() == 0.5
+
+    clock.now += 2
+    assert scheduler.run_due() == 2
+    assert result == ['first', 'second']
+    assert scheduler.timeout() is None
+
+
+def test_cancelled_action_not_executed():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock)
+    result = []
+    action = scheduler.call_later(1, result.append, 'cancelled')
+    action.cancel()
+
+    clock.now += 1
+    assert scheduler.next_deadline() is None
+    assert scheduler.run_due() == 0
+    assert not result
+
+
+def test_failed_action_does_not_stop_others():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock)
+    result = []
+    scheduler.call_later(0, lambda: 1 / 0)
+    scheduler.call_later(0, result.append, 'ok')
+
+    assert scheduler.run_due() == 2
+    assert result == ['ok']
+
+
+def test_named_timers_run_concurrently():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock)
+    result = []
+    scheduler.set_timer('main', 10, result.append, 'main')
+    scheduler.set_timer('entry', 0.25, result.append, 'entry')
+
+    assert scheduler.timeout() == 0.25
+    assert scheduler.remaining('main') == 10
+
+    clock.now += 0.25
+    scheduler.run_due()
+    assert result == ['entry']
+    assert scheduler.remaining('entry') is None, "fired timer should be forgotten"
+    assert scheduler.timeout() == 9.75
+
+
+def test_named_timer_restart_and_cancel():
+    clock = FakeClock()
+    scheduler = Scheduler(clock=clock)
+    result = []
+    scheduler.set_timer('main', 1, result.append, 'first')
+    scheduler.set_timer('main', 2, result.append, 'restarted')
+    scheduler.call_later(3, result.append, 'action')
+
+    clock.now += 2
+    scheduler.run_due()
+    assert result == ['restarted']
+
+    scheduler.set_timer('main', 1, result.append, 'cancelled')
+    assert scheduler.cancel_timer('main')
+    assert not scheduler.cancel_timer('main')
+    scheduler.cancel_timers()
+
+    clock.now += 1
+    scheduler.run_due()
+    assert result == ['restarted', 'action'], "cancel_timers should keep unnamed actions"
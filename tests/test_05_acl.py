@@ -0,0 +1,71 @@
+import os
+
+from ..acl import AccessIndex, CompiledAccessIndex, compile_acl, patch_acl
+
+
+def test_access_index_levels():
+    index = AccessIndex({
+        'CODE1': [1, 2],
+        'CODE2': ['2'],
+        12345: [3],
+    })
+
+    assert index.codes(1) == {'CODE1'}
+    assert index.codes('2') == {'CODE1', 'CODE2'}
+    assert '12345' in index.codes(3), "numeric codes should be matched as strings"
+    assert not index.codes(5), "no codes expected for unconfigured alert level"
+    assert len(index) == 3
+
+
+def test_access_index_large():
+    acl = {f'{code:08d}': [code % 5] for code in range(50000)}
+    index = AccessIndex(acl)
+
+    assert len(index.codes(0)) == 10000
+    assert '00049999' in index.codes(4)
+    assert '00049999' not in index.codes(0)
+
+
+def test_compiled_access_index(tmp_path):
+    path = os.path.join(str(tmp_path), 'acl.bin')
+    acl = {f'{code:08d}': [code % 5, 7] for code in range(10000)}
+
+    assert compile_acl(acl, path)
+    assert not compile_acl(acl, path), "unchanged ACL should not be written again"
+
+    index = CompiledAccessIndex(path)
+    assert len(index) == 10000
+    assert index.levels == [0, 1, 2, 3, 4, 7]
+    assert '00000003' in index.codes(3)
+    assert '00000003' not in index.codes(4)
+    assert '00000003' in index.codes(7)
+    assert 'UNKNOWN' not in index.codes(7)
+
+
+def test_access_index_apply():
+    index = AccessIndex({'CODE1': [1, 2], 'CODE2': [2], 'CODE3': [3]})
+    levels = index.levels
+
+    patched = index.apply({'CODE2': [1], 'CODE4': [1]}, ['CODE1'])
+
+    assert patched.codes(1) == {'CODE2', 'CODE4'}
+    assert patched.codes(2) == frozenset()
+    assert patched.codes(3) is levels[3], "untouched alert levels should be shared"
+    assert len(patched) == 3
+    assert len(patched.apply({'CODE5': []})) == 3, "entry without alert levels grants nothing"
+    assert len(patched.apply({'CODE2': [2, 3], 'CODE6': [1]}, ['CODE4', 'UNKNOWN'])) == 3
+    assert index.codes(1) == {'CODE1'}, "original index should not change"
+
+
+def test_compiled_access_index_patch(tmp_path):
+    path = os.path.join(str(tmp_path), 'acl.bin')
+    compile_acl({'CODE1': [1], 'CODE2': [1, 2]}, path)
+
+    assert patch_acl(path, {'CODE2': [2], 'CODE3': [1]}, ['CODE1'])
+
+    index = CompiledAccessIndex(path)
+    assert 'CODE3' in index.codes(1)
+    assert 'CODE1' not in index.codes(1)
+    assert 'CODE2' not in index.codes(1)
+    assert 'CODE2' in index.codes(2)
+    assert len(index) == 2
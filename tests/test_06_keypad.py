@@ -0,0 +1,63 @@
+from ..keypad import CardDebounce, CodeTrie, Frame, FrameReader, KeypadEntry, CARD_EVENT, KBD_EVENT, MAX_FRAME
+
+
+def test_frames_reassembled_from_chunks():
+    reader = FrameReader()
+
+    assert reader.feed(b'\x02\x00KB1') == []
+    frames = reader.feed(b'\r\n\x02\x00CD00ABCDEF\r\n\x02\x00K')
+
+    assert [f.kind for f in frames] == [KBD_EVENT, CARD_EVENT]
+    assert frames[0].raw == b'\x02\x00KB1\r\n'
+    assert frames[1].raw == b'\x02\x00CD00ABCDEF\r\n'
+    assert bytes(reader.buffer) == b'\x02\x00K', "partial frame should stay buffered"
+
+
+def test_noise_counted():
+    reader = FrameReader()
+
+    frames = reader.feed(b'\r\n\x00garbage\n' + b'x' * (MAX_FRAME + 1))
+    frames += reader.feed(b'\x02\x00KB11\n')
+
+    counters = reader.metrics.snapshot()['counters']
+    assert [f.raw for f in frames] == [b'\x02\x00KB11\n']
+    assert counters['serial.malformed'] == 1
+    assert counters['serial.dropped'] == 1
+    assert counters['serial.frames'] == 1
+
+
+def test_card_debounce():
+    debounce = CardDebounce(window=2, size=2)
+    card, other, third = (b'\x02\x00CD%s\r\n' % card for card in (b'01', b'02', b'03'))
+
+    assert debounce.accept(Frame(CARD_EVENT, card, 10))
+    assert not debounce.accept(Frame(CARD_EVENT, card, 11))
+    assert not debounce.accept(Frame(CARD_EVENT, card, 12.5)), "held card should extend window"
+    assert debounce.accept(Frame(CARD_EVENT, other, 12.5))
+    assert debounce.accept(Frame(KBD_EVENT, b'\x02\x00KB1\r\n', 12.5))
+    assert debounce.accept(Frame(KBD_EVENT, b'\x02\x00KB1\r\n', 12.6)), "keypad is never debounced"
+    assert debounce.accept(Frame(CARD_EVENT, card, 15))
+
+    # ring keeps last two cards only
+    assert debounce.accept(Frame(CARD_EVENT, third, 15.1))
+    assert debounce.accept(Frame(CARD_EVENT, card, 15.2)), "evicted card should be accepted"
+    assert debounce.metrics.snapshot()['counters']['input.cards_coalesced'] == 2
+
+
+def test_keypad_entry_trie():
+    trie = CodeTrie({'1234', '1299', 'CARD01', '5'})
+    entry = KeypadEntry(trie)
+
+    assert trie.size == 3, "codes with letters could not be typed"
+    assert entry.push('1') and entry.push('2')
+    assert not entry.unambiguous
+    assert entry.push('3') and entry.push('4')
+    assert entry.unambiguous and entry.code == '1234'
+
+    entry.reset(trie)
+    assert not entry.push('7'), "unknown prefix should be rejected at once"
+    assert not entry.push('1'), "rejected entry stays rejected"
+
+    entry.reset()
+    assert entry.push('7'), "without trie every prefix is possible"
+    assert CodeTrie.build(object()) is None
@@ -0,0 +1,99 @@
+import os
+
+from ..outbox import EventOutbox
+
+
+def test_events_spooled_while_offline_and_replayed(tmp_path):
+    sent = []
+    online = [False]
+    spool_path = os.path.join(str(tmp_path), 'outbox.spool')
+    outbox = EventOutbox(sender=sent.extend, spool_path=spool_path, online=lambda: online[0])
+
+    outbox.put({'content': 'first'})
+    outbox.put({'content': 'second'})
+    outbox._flush(outbox._collect(0))
+    assert not sent
+    assert outbox.spooled == 2
+
+    # spool survives restart
+    outbox = EventOutbox(sender=sent.extend, spool_path=spool_path, online=lambda: online[0])
+    assert outbox.spooled == 2
+
+    online[0] = True
+    outbox.put({'content': 'third'})
+    outbox._replay()
+    outbox._flush(outbox._collect(0))
+    assert [event['content'] for event in sent] == ['first', 'second', 'third']
+    assert outbox.spooled == 0
+
+
+def test_failed_send_spooled(tmp_path):
+    def _fail(events):
+        raise ConnectionError('broker is gone')
+
+    outbox = EventOutbox(sender=_fail, spool_path=os.path.join(str(tmp_path), 'outbox.spool'))
+    outbox.put({'content': 'lost?'})
+    outbox._flush(outbox._collect(0))
+
+    assert outbox.spooled == 1
+    assert outbox.metrics.snapshot()['counters']['outbox.failed'] == 1
+
+
+def test_spool_failure_keeps_events(tmp_path):
+    sent = []
+    online = [False]
+    # spool in missing directory could not be written
+    outbox = EventOutbox(sender=sent.extend, spool_path=os.path.join(str(tmp_path), 'gone', 'outbox.spool'),
+                         online=lambda: online[0])
+    outbox._stopped.wait = lambda timeout: outbox._stopped.set()
+    outbox.put({'content': 'kept'})
+    outbox._run()
+
+    assert [event['content'] for event in outbox.pending] == ['kept'], "batch should be kept for retry"
+    assert outbox.metrics.counters['outbox.spool_errors'] == 1
+
+    online[0] = True
+    outbox._stopped.clear()
+    outbox._collect = lambda timeout: outbox._stopped.set() or []
+    outbox._run()
+    assert [event['content'] for event in sent] == ['kept']
+    assert sent[0]['time'] > 0, "event time should be recorded when enqueued"
+
+
+def test_corrupt_spool_line_skipped(tmp_path):
+    sent = []
+    spool_path = os.path.join(str(tmp_path), 'outbox.spool')
+    with open(spool_path, 'w') as fh:
+        fh.write('{"content": "first"}\n{"type": "acc')
+    outbox = EventOutbox(sender=sent.extend, spool_path=spool_path)
+    outbox._stopped.wait = lambda timeout: outbox._stopped.set()
+    outbox.put({'content': 'second'})
+    outbox._flush(outbox._collect(0))
+
+    outbox._collect = lambda timeout: outbox._stopped.set() or []
+    outbox._run()
+
+    assert [event['content'] for event in sent] == ['first', 'second']
+    assert outbox.metrics.counters['outbox.corrupt'] == 1
+    assert outbox.spooled == 0
+
+
+def test_spool_not_locked_while_replaying(tmp_path):
+    spool_path = os.path.join(str(tmp_path), 'outbox.spool')
+    outbox = EventOutbox(sender=None, spool_path=spool_path, maxsize=1)
+    outbox._spool([{'content': 'spooled'}])
+    sent = []
+
+    def _slow_broker(events):
+        # access events overflowing queue while broker is slow
+        outbox.put({'content': 'queued'})
+        outbox.put({'content': 'spilled'})
+        sent.extend(events)
+
+    outbox.sender = _slow_broker
+    outbox._replay()
+
+    assert [event['content'] for event in sent] == ['spooled']
+    assert outbox.spooled == 1, "event spooled during replay should be kept"
+    outbox._replay()
+    assert [event['content'] for event in sent][-1] == 'spilled'
@@ -0,0 +1,81 @@
+import os
+import time
+
+from ..config import DoorConfig, LockConfig
+from ..doors import DoorLockDevice, DoorSystemConfig, setup_doors
+from ..keypad import KBD_EVENT, SerialMux
+
+
+class PipePort:
+
+    """ Read end of pipe with serial port interface """
+
+    def __init__(self):
+        self.rfd, self.wfd = os.pipe()
+        self.in_waiting = 0
+
+    def fileno(self):
+        return self.rfd
+
+    def read(self, size):
+        return os.read(self.rfd, size)
+
+
+def test_door_config_follows_main(tmp_path):
+    main = LockConfig(str(tmp_path / 'device.yml'))
+    main.update({'closed': True, 'blocked': False, 'alert': 1, 'acl': {'111': [1], '222': [2]}})
+    door = DoorConfig(str(tmp_path / 'door-north.yml'), main)
+    door.update({'closed': False})
+
+    assert door.acl_index is main.acl_index, "door should share main ACL index"
+    assert '111' in door.snapshot.access_list
+    assert door.snapshot.closed is False and main.snapshot.closed is True, "closed state is per door"
+
+    main.update({'alert': 2, 'blocked': True})
+
+    assert '222' in door.snapshot.access_list, "door should follow main alert level"
+    assert door.snapshot.blocked is True, "door should follow main blocked state"
+
+
+def test_serial_mux_routes_frames():
+    mux = SerialMux(timeout=.1)
+    ports = [PipePort(), PipePort()]
+    received = {0: [], 1: []}
+    for idx, port in enumerate(ports):
+        mux.register(port, received[idx].append)
+    mux.start()
+
+    os.write(ports[1].wfd, b'\x02\x00KB1\r\n')
+    os.write(ports[0].wfd, b'\x02\x00KB2\r\n')
+    for _ in range(50):
+        if received[0] and received[1]:
+            break
+        time.sleep(.02)
+
+    assert [f.raw for f in received[0]] == [b'\x02\x00KB2\r\n']
+    assert [f.kind for f in received[1]] == [KBD_EVENT]
+
+
+def test_door_shares_main_io(get_device, tmp_path):
+    main, devcfg, syscfg = get_device()
+    audit_path = str(tmp_path / 'door-audit.log')
+    door_system = DoorSystemConfig(syscfg, {'name': 'north', 'pin': 12, 'audit_log': audit_path})
+    door = DoorLockDevice(door_system, DoorConfig(str(tmp_path / 'door-north.yml'), devcfg), 'north', main)
+
+    assert door.outbox is main.outbox and door.audit is main.audit and door.capture is main.capture
+    assert door.gpio is main.gpio and door.watchdog is main.watchdog
+    assert not os.path.exists(audit_path), "door should not open its own audit log"
+
+
+def test_doors_need_own_port_and_pin(get_device, tmp_path):
+    main, _, syscfg = get_device()
+    system = DoorSystemConfig(syscfg, {'comport': '/dev/ttyS1', 'pin': 11, 'doors': [
+        {'name': 'north', 'comport': '/dev/ttyUSB0', 'pin': 12},
+        {'name': 'south', 'pin': 13},
+        {'name': 'east', 'comport': '/dev/ttyUSB1', 'pin': 11},
+        {'name': 'west', 'comport': '/dev/ttyUSB0', 'pin': 14},
+    ]})
+
+    doors = setup_doors(system, main, str(tmp_path))
+
+    assert [door.door for door in doors] == ['north'], "doors without own port and relay pin should be skipped"
@@ -0,0 +1,69 @@
+import asyncio
+
+import yaml
+from skabenclient.config import SystemConfig
+
+from ..async_device import AsyncLockDevice
+from ..comport import BACKOFF_MAX
+from ..config import LockConfig
+from ..device import SERIAL_EVENT
+from ..keypad import FrameReader
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+
+    """ Event loop which time jumps to the nearest timer instead of waiting for it """
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+        select = self._selector.select
+
+        def _select(timeout=None):
+            events = select(0)
+            if not events and timeout:
+                self.now += timeout
+            return events
+
+        self._selector.select = _select
+
+    def time(self):
+        return self.now
+
+
+def make_device(tmp_path, loop):
+    system_path, device_path = str(tmp_path / 'system.yml'), str(tmp_path / 'device.yml')
+    with open(system_path, 'w') as fh:
+        yaml.dump({'pin': 11, 'gpio': 'fake', 'metrics_interval': 0, 'outbox_spool': str(tmp_path / 'outbox.spool')}, fh)
+    with open(device_path, 'w') as fh:
+        yaml.dump({'closed': True, 'blocked': False, 'sound': False, 'alert': 0, 'acl': {'CARD1': [0]}}, fh)
+    return AsyncLockDevice(SystemConfig(system_path), LockConfig(device_path), loop=loop)
+
+
+def test_async_feedback_timeline(tmp_path):
+    loop = VirtualClockLoop()
+    device = make_device(tmp_path, loop)
+    device.gpio.clock = loop.time
+    device.closed = True
+    for frame in FrameReader().feed(b'\x02\x00CDCARD1\r\n'):
+        loop.call_soon(device.dispatch, (SERIAL_EVENT, frame, frame.stamp))
+    loop.run_until_complete(asyncio.sleep(30))
+    loop.close()
+
+    assert device.gpio.edges == [(1.0, 11, False), (11.0, 11, True)], "relay should open after feedback and close by timer"
+    assert device.config.snapshot.closed is True
+
+
+def test_serial_reconnect_retried_after_executor_error(tmp_path):
+    loop = VirtualClockLoop()
+    device = make_device(tmp_path, loop)
+    retries = []
+    device._serial_reconnect = lambda: retries.append(loop.time())
+
+    failed = loop.create_future()
+    failed.set_exception(RuntimeError('executor is shut down'))
+    device._serial_reconnected(failed)
+    loop.run_until_complete(asyncio.sleep(BACKOFF_MAX + 1))
+    loop.close()
+
+    assert retries == [BACKOFF_MAX]
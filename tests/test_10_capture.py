@@ -0,0 +1,41 @@
+from ..capture import CaptureWriter, read_capture, replay
+from ..keypad import FrameReader
+
+TRAFFIC = [b'\x02\x00KB1', b'\r\n\x00noise\n\x02\x00CD00AB', b'CDEF\r\n', b'\x02\x00KB11\r\n']
+
+
+def test_capture_replay(tmp_path):
+    path = str(tmp_path / 'serial.cap')
+    capture = CaptureWriter(path)
+    reader = FrameReader(capture=capture)
+    live = []
+    for chunk in TRAFFIC:
+        live += [frame.raw for frame in reader.feed(chunk)]
+    capture.close()
+
+    records = list(read_capture(path))
+    assert [chunk for _, chunk in records] == TRAFFIC, "capture should keep raw chunks as they were read"
+    assert records[0][0] == 0
+
+    replayed = []
+    stats = replay(path, replayed.append)
+    assert replayed == live
+    assert stats['chunks'] == len(TRAFFIC)
+    assert stats['counters']['serial.malformed'] == 1
+
+
+def test_port_data_opens_lock(get_device, get_port_data):
+    device, devcfg, _ = get_device()
+    devcfg.update({'closed': True, 'blocked': False, 'alert': 0, 'acl': {'CARD1': [0]}})
+    device.closed = True
+
+    for line in get_port_data(b'\x00noise\n\x02\x00CDCARD2\r\n'):
+        device.parse_data(line)
+    assert not device.opening, "unknown card should not open lock"
+
+    device.input_hold.cancel()
+    device._release_input(True)
+    for line in get_port_data(b'\x02\x00CDCARD1\r\n'):
+        device.parse_data(line)
+    assert device.opening, "card from port should open lock"
+    device.opening.cancel()
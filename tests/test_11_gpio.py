@@ -0,0 +1,51 @@
+import yaml
+from skabenclient.config import SystemConfig
+
+from ..config import LockConfig
+from ..device import LockDevice
+from ..gpio import FakeGpio, SysfsGpio
+
+
+def test_writes_are_edge_only():
+    gpio = FakeGpio(clock=lambda: 1.0)
+    gpio.output(11)
+
+    assert gpio.write(11, True)
+    assert not gpio.write(11, 1), "same value should not be written again"
+    assert gpio.write(11, False)
+
+    assert gpio.edges == [(1.0, 11, True), (1.0, 11, False)]
+    assert gpio.toggles(11) == 2
+    assert gpio.metrics.snapshot()['counters']['gpio.skipped'] == 1
+
+
+def test_sysfs_backend(tmp_path):
+    (tmp_path / 'gpio7').mkdir()
+    (tmp_path / 'gpio7' / 'value').write_text('0')
+    gpio = SysfsGpio(root=str(tmp_path))
+    gpio.output(7)
+    gpio.write(7, True)
+
+    assert (tmp_path / 'gpio7' / 'direction').read_text() == 'out'
+    assert (tmp_path / 'gpio7' / 'value').read_text() == '1'
+
+
+def test_relay_armed_from_saved_state_before_sound(tmp_path):
+    system_path, device_path = str(tmp_path / 'system.yml'), str(tmp_path / 'device.yml')
+    with open(system_path, 'w') as fh:
+        yaml.dump({'pin': 11, 'gpio': 'fake', 'outbox_spool': str(tmp_path / 'outbox.spool')}, fh)
+    with open(device_path, 'w') as fh:
+        yaml.dump({'closed': False, 'blocked': True, 'sound': True, 'acl': {}}, fh)
+    device = LockDevice(SystemConfig(system_path), LockConfig(device_path))
+    device.connect_serial = lambda: 'port'
+    relay_at_sound_init = []
+    device._snd_init = lambda *args: relay_at_sound_init.extend(device.gpio.edges)
+
+    device.gpio_setup()
+    device.start_sound()
+    device.sound_thread.join(5)
+
+    edges = [(pin, value) for _, pin, value in relay_at_sound_init]
+    assert edges == [(11, True)], "blocked lock should be armed before sound init"
+    report = device.boot.report()
+    assert all(phase in report for phase in ('init', 'gpio', 'serial', 'sound'))
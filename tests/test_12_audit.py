@@ -0,0 +1,57 @@
+import os
+import time
+
+import pytest
+
+from ..acl import code_hash
+from ..audit import ACCESS_DENIED, ACCESS_GRANTED, AuditLog, main
+
+
+def test_audit_ring(tmp_path):
+    path = str(tmp_path / 'audit.log')
+    log = AuditLog(path, capacity=3)
+    for idx in range(5):
+        log.append(ACCESS_GRANTED if idx % 2 else ACCESS_DENIED, f'CODE{idx}', alert=2, latency=.001, door=1)
+    log.close()
+
+    log = AuditLog(path, capacity=100)
+    records = list(log.records())
+    assert log.capacity == 3, "existing log should keep its capacity"
+    assert [r.code for r in records] == [code_hash(f'CODE{idx}') for idx in (2, 3, 4)], "oldest should be overwritten"
+    assert records[1].event == ACCESS_GRANTED and records[1].alert == 2 and records[1].door == 1
+    assert [r.code for r in log.records(code='CODE3')] == [code_hash('CODE3')]
+    assert list(log.records(since=time.time() + 60)) == []
+    log.close()
+
+
+def test_audit_cli(tmp_path, capsys):
+    path = str(tmp_path / 'audit.log')
+    log = AuditLog(path, capacity=10)
+    log.append(ACCESS_GRANTED, '1234', alert=0)
+    log.close()
+
+    main([path, '--since', '1h', '--format', 'csv'])
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'time,code,event,alert,door,latency_ms'
+    assert ',granted,0,0,' in lines[1]
+
+
+def test_audit_query_is_readonly(tmp_path):
+    path = str(tmp_path / 'audit.log')
+    with pytest.raises(SystemExit):
+        main([path])
+    assert not os.path.exists(path), "query should not create audit log"
+
+    AuditLog(path, capacity=10).close()
+    os.chmod(path, 0o444)
+    log = AuditLog(path, readonly=True)
+    assert list(log.records()) == []
+    log.close()
+
+    broken = str(tmp_path / 'broken.log')
+    AuditLog(broken, capacity=10).close()
+    with open(broken, 'ab') as fh:
+        fh.write(b'tail')
+    with pytest.raises(ValueError):
+        AuditLog(broken, readonly=True)
@@ -0,0 +1,87 @@
+import logging
+
+from ..logs import Fields, RateLimitFilter, log_fields, setup_async_logging
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Payload:
+
+    """ Counts how many times it was formatted """
+
+    formatted = 0
+
+    def __str__(self):
+        Payload.formatted += 1
+        return 'payload'
+
+
+def _record(lineno: int, msg: str = 'noise', level: int = logging.DEBUG) -> logging.LogRecord:
+    return logging.LogRecord('lock', level, 'device.py', lineno, msg, None, None)
+
+
+def test_rate_limit_by_call_site():
+    clock = Clock()
+    limit = RateLimitFilter(rate=1, burst=2, clock=clock)
+
+    passed = [limit.filter(_record(10, f'noise {idx}')) for idx in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert limit.filter(_record(20)), "other call sites should not be limited"
+
+    clock.now += 1
+    record = _record(10)
+    assert limit.filter(record)
+    assert record.msg == 'noise [3 similar suppressed]'
+
+    noise = _record(30, level=logging.ERROR)
+    noise.rate_limited = True
+    assert [limit.filter(noise) for _ in range(3)] == [True, True, False], "marked noise should be limited"
+
+
+def test_access_records_are_not_limited():
+    logger = logging.getLogger('test_logs_access')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    handler.addFilter(RateLimitFilter(rate=1, burst=2, clock=Clock()))
+    logger.addHandler(handler)
+    try:
+        for idx in range(50):
+            log_fields(logger, logging.INFO, 'access', code=str(idx), success=False)
+            logger.info('[---] CLOSE by %s', idx)
+    finally:
+        logger.handlers.clear()
+
+    assert len(records) == 100, "access decisions should never be dropped"
+
+
+def test_records_formatted_by_listener():
+    logger = logging.getLogger('test_logs')
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    records = []
+    handler = logging.Handler()
+    handler.emit = lambda record: records.append(handler.format(record))
+    logger.addHandler(handler)
+    listeners = setup_async_logging(logger)
+    try:
+        Payload.formatted = 0
+        logger.debug('data: %s', Payload())
+        log_fields(logger, logging.INFO, 'access', code='1234', success=True, door=None)
+        for listener in listeners:
+            listener.stop()
+    finally:
+        logger.handlers.clear()
+
+    assert records == ['data: payload', 'access code=1234 success=True']
+    assert Payload.formatted == 1, "record should be formatted once, by listener"
+    assert str(Fields(a=1, b=None)) == 'a=1'
@@ -0,0 +1,50 @@
+import socket
+
+from ..heartbeat import Watchdog, sd_notify
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_watchdog_pets_only_healthy_lock():
+    clock = FakeClock()
+    notified = []
+    watchdog = Watchdog(budget=.5, stall=10, notify=notified.append, clock=clock)
+
+    watchdog.beat('loop', .01)
+    watchdog.beat('serial')
+    assert watchdog.check()
+
+    watchdog.beat('loop', 2)
+    assert not watchdog.check(), "lag over budget"
+    assert not watchdog.stalled, "lag is not a stall"
+
+    watchdog.beat('loop', .01)
+    clock.now += 11
+    watchdog.beat('loop', .01)
+    assert watchdog.problems() == (['serial stalled for 11.0s'], [])
+    assert not watchdog.check()
+    assert watchdog.stalled
+
+    watchdog.beat('serial')
+    assert watchdog.check()
+    assert notified == ['WATCHDOG=1', 'WATCHDOG=1']
+    assert watchdog.metrics.summary('lag.')['loop'][0] == 4
+    assert '--- MainThread' in watchdog.dump_stacks()
+
+
+def test_sd_notify(tmp_path, monkeypatch):
+    path = str(tmp_path / 'notify')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.bind(path)
+        monkeypatch.setenv('NOTIFY_SOCKET', path)
+        assert sd_notify('WATCHDOG=1')
+        assert sock.recv(64) == b'WATCHDOG=1'
+    monkeypatch.delenv('NOTIFY_SOCKET')
+    assert not sd_notify('WATCHDOG=1')
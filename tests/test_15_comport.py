@@ -0,0 +1,101 @@
+import os
+import threading as th
+from queue import Queue
+
+import yaml
+from skabenclient.config import SystemConfig
+
+from ..comport import SerialLink
+from ..config import LockConfig
+from ..device import LockDevice
+
+
+class FakePort:
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_link_probes_candidates(tmp_path):
+    present = str(tmp_path / 'ttyUSB0')
+    open(present, 'w').close()
+    link = SerialLink([str(tmp_path / 'ttyS1'), present], opener=FakePort)
+
+    port = link.connect()
+
+    assert port.path == present, "missing candidate should be skipped"
+    assert not link.stale()
+
+
+def test_link_detects_replaced_node(tmp_path):
+    path = str(tmp_path / 'ttyUSB0')
+    open(path, 'w').close()
+    link = SerialLink([path], opener=FakePort)
+    link.connect()
+
+    # adapter re-enumerated: node is replaced by a new one with the same name
+    open(path + '.new', 'w').close()
+    os.replace(path + '.new', path)
+    assert link.stale()
+
+    os.remove(path)
+    assert link.stale()
+
+
+def test_link_reconnects_with_backoff(tmp_path):
+    path = str(tmp_path / 'ttyUSB0')
+    open(path, 'w').close()
+    link = SerialLink([path], opener=FakePort)
+    link.backoff_min = .01
+    old = link.connect()
+    os.remove(path)
+    idle = []
+
+    th.Timer(.1, lambda: open(path, 'w').close()).start()
+    port = link.reconnect('read failed', idle=lambda: idle.append(1))
+
+    assert old.closed, "lost port should be closed"
+    assert port is link.port and port is not old
+    assert len(idle) >= 2, "probing rounds should report idle"
+    assert link.metrics.counters == {'serial.lost': 1, 'serial.reconnects': 1}
+    assert link.metrics.summary('serial.')['recover'][0] == 1
+
+
+def test_closed_link_stops_connecting(tmp_path):
+    link = SerialLink([str(tmp_path / 'ttyUSB0')], opener=FakePort)
+    th.Timer(.1, link.close).start()
+
+    assert link.connect() is None
+
+
+class ClosedUnderReader:
+
+    """ Port closed by stop() while serial thread waits on it """
+
+    def __init__(self, link):
+        self.link = link
+
+    @property
+    def in_waiting(self):
+        self.link.close()
+        raise TypeError("'NoneType' object cannot be interpreted as an integer")
+
+    def read(self, size):
+        return b''
+
+
+def test_serial_read_stops_on_closed_link(tmp_path):
+    system_path, device_path = str(tmp_path / 'system.yml'), str(tmp_path / 'device.yml')
+    with open(system_path, 'w') as fh:
+        yaml.dump({'pin': 11, 'gpio': 'fake', 'outbox_spool': str(tmp_path / 'outbox.spool')}, fh)
+    with open(device_path, 'w') as fh:
+        yaml.dump({'closed': True, 'blocked': False, 'sound': False, 'acl': {}}, fh)
+    device = LockDevice(SystemConfig(system_path), LockConfig(device_path))
+
+    device._serial_read(ClosedUnderReader(device.link), Queue())
+
+    assert 'serial.lost' not in device.link.metrics.counters, "closed link should not be reconnected"
@@ -0,0 +1,123 @@
+import os
+from types import SimpleNamespace
+
+from .. import sound
+from ..sound import AudioScheduler, Cue, CUE_FADE, CUE_LOOP, CUE_PLAY, CUE_STOP, SoundBank
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBank:
+
+    def get(self, name):
+        return name
+
+
+class FakeChannel:
+
+    def __init__(self):
+        self.sound = None
+        self.played = []
+
+    def play(self, sound, loops=0, fade_ms=0):
+        self.sound = sound
+        self.played.append((sound, loops))
+
+    def stop(self):
+        self.sound = None
+
+    def fadeout(self, ms):
+        self.sound = None
+
+    def get_busy(self):
+        return bool(self.sound)
+
+
+class FakeSound:
+
+    def __init__(self, file):
+        self.file = file
+
+    def get_length(self):
+        # second of sound per byte of file
+        return float(os.path.getsize(self.file))
+
+
+def make_audio():
+    clock = FakeClock()
+    channels = {'bg': FakeChannel(), 'fg': FakeChannel()}
+    return AudioScheduler(FakeBank(), channels, end_events=False, clock=clock), clock, channels
+
+
+def test_cues_run_at_due_time():
+    audio, clock, channels = make_audio()
+    audio.cue(Cue(CUE_PLAY, 'fg', 'off'), delay=1.5)
+    audio.cue(Cue(CUE_FADE, 'bg', fade_ms=1200))
+    audio.cue(Cue(CUE_PLAY, 'fg', 'on'), delay=.5)
+
+    assert audio.run_due() == .5
+    assert channels['fg'].played == []
+
+    clock.now += 1.6
+    assert audio.run_due() is None
+    assert channels['fg'].played == [('on', 0), ('off', 0)], "cues should run in due time order"
+    assert audio.metrics.summary('sound.')['cue_lag'][0] == 3
+
+
+def test_loop_is_restarted_until_stopped():
+    audio, clock, channels = make_audio()
+    bg = channels['bg']
+    audio.cue(Cue(CUE_LOOP, 'bg', 'field'))
+    audio.cue(Cue(CUE_LOOP, 'bg', 'field'))
+    audio.run_due()
+    assert bg.played == [('field', -1)], "looping sound should not be interrupted"
+
+    bg.stop()  # mixer glitch
+    audio.check_loops()
+    assert bg.played == [('field', -1), ('field', -1)]
+    assert audio.metrics.counters['sound.loop_restarts'] == 1
+
+    audio.cue(Cue(CUE_STOP, 'bg'))
+    audio.run_due()
+    audio.on_end('bg')
+    assert not bg.get_busy(), "stopped loop should stay stopped"
+
+
+def test_sound_bank_picks_up_new_files(tmp_path, monkeypatch):
+    mixer = SimpleNamespace(Sound=FakeSound, get_init=lambda: (1000, -16, 1))
+    monkeypatch.setattr(sound, 'pg', SimpleNamespace(mixer=mixer))
+    (tmp_path / 'granted.ogg').write_bytes(b'')
+    bank = SoundBank(str(tmp_path))
+    scans = []
+    files = bank.files
+    monkeypatch.setattr(bank, 'files', lambda: scans.append(1) or files())
+
+    bank.preload()
+    bank.get('granted')
+    bank.load('granted')
+    assert len(scans) == 1, "sound_dir should be scanned once, not on every decode"
+
+    (tmp_path / 'alarm.wav').write_bytes(b'')
+    assert bank.reload_changed() == ['alarm']
+    assert bank.get('alarm').file == str(tmp_path / 'alarm.wav')
+    assert len(scans) == 2
+
+
+def test_preload_fills_budget(tmp_path, monkeypatch):
+    mixer = SimpleNamespace(Sound=FakeSound, get_init=lambda: (1000, -16, 1))
+    monkeypatch.setattr(sound, 'pg', SimpleNamespace(mixer=mixer))
+    for name, length in (('alarm', 1), ('field', 3), ('granted', 1)):
+        (tmp_path / f'{name}.ogg').write_bytes(b'x' * length)
+    bank = SoundBank(str(tmp_path), max_bytes=5000)
+
+    bank.preload()
+
+    assert set(bank.clips) == {'alarm', 'granted'}, "clip over budget should not stop preloading smaller ones"
+    assert bank.size == 4000